@@ -0,0 +1,152 @@
+import os
+import glob
+import hashlib
+
+
+class QBlobs:
+    """
+    Content-addressed store of the large artifacts of the tickets stored in the WORKDIR.
+
+    Each distinct content is kept once as WORKDIR/.q.blobs/<xx>/<sha1> and the ticket files are
+    hard links to it, so that a blob is unreferenced when its link count drops to one. Blobs are
+    read-only, since writing a ticket file in place would change every ticket sharing it.
+    """
+
+    # Ticket files kept in the store.
+    PATTERNS = ('*.sql', '*.sql.gz', 'review-*.diff')
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def path(self, digest=None):
+        ret = os.path.join(self.settings.WORKDIR, '.q.blobs')
+        if digest:
+            ret = os.path.join(ret, digest[0:2], digest)
+        return ret
+
+    @staticmethod
+    def digest(path):
+        """
+        Calculate the content hash of the file.
+        """
+        sha = hashlib.sha1()
+        with open(path, 'rb') as input:
+            while True:
+                data = input.read(1024 * 1024)
+                if not data:
+                    break
+                sha.update(data)
+        return sha.hexdigest()
+
+    @staticmethod
+    def replace(path, source):
+        """
+        Replace the file atomically with a hard link to the source file.
+        """
+        if os.path.exists(path):
+            st, source_st = os.stat(path), os.stat(source)
+            if (st.st_dev, st.st_ino) == (source_st.st_dev, source_st.st_ino):
+                # Renaming a link onto the same file would do nothing and leave the temporary link.
+                return
+        dir, name = os.path.split(path)
+        tmp = os.path.join(dir, '.' + name + '.tmp')
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.link(source, tmp)
+        os.rename(tmp, path)
+
+    def inside(self, path):
+        """
+        Check if the file is in some ticket directory of the WORKDIR.
+        """
+        workdir = os.path.realpath(self.settings.WORKDIR)
+        return os.path.realpath(path).startswith(workdir + os.sep)
+
+    def store(self, path):
+        """
+        Move the file content to the store and link the file to its blob.
+
+        Returns the number of bytes saved, which is zero unless the same content was already
+        stored, or None if the file could not be stored.
+        """
+        if not self.inside(path):
+            return None
+        try:
+            st = os.stat(path)
+            if st.st_nlink > 1:
+                # Already linked.
+                return 0
+            blob = self.path(QBlobs.digest(path))
+            if os.path.exists(blob):
+                QBlobs.replace(path, blob)
+                return st.st_size
+            if not os.path.isdir(os.path.dirname(blob)):
+                os.makedirs(os.path.dirname(blob))
+            os.link(path, blob)
+            os.chmod(blob, 0444)
+            return 0
+        except (IOError, OSError):
+            # Files stay unshared, e.g. on a file system without hard links.
+            return None
+
+    def link(self, source, target):
+        """
+        Make the target file share the blob of the source file. Returns True on success.
+        """
+        if self.store(source) is None:
+            return False
+        try:
+            QBlobs.replace(target, source)
+        except OSError:
+            return False
+        return True
+
+    def adopt(self, codes):
+        """
+        Store the artifacts of the given tickets not yet in the store.
+        Returns the number of files now in the store and bytes saved.
+        """
+        files = 0
+        saved = 0
+        for code in codes:
+            for pattern in QBlobs.PATTERNS:
+                for path in glob.glob(os.path.join(self.settings.WORKDIR, code, pattern)):
+                    n = self.store(path)
+                    if n is not None:
+                        files += 1
+                        saved += n
+        return (files, saved)
+
+    def digests(self, codes):
+        """
+        Collect the content hashes of the artifacts of the given tickets.
+        """
+        stored = {}
+        for blob in glob.glob(os.path.join(self.path(), '*', '*')):
+            st = os.lstat(blob)
+            stored[(st.st_dev, st.st_ino)] = os.path.basename(blob)
+        ret = set()
+        for code in codes:
+            for pattern in QBlobs.PATTERNS:
+                for path in glob.glob(os.path.join(self.settings.WORKDIR, code, pattern)):
+                    st = os.stat(path)
+                    ret.add(stored.get((st.st_dev, st.st_ino)) or QBlobs.digest(path))
+        return ret
+
+    def collect(self):
+        """
+        Remove blobs not linked from any ticket.
+        Returns the number of blobs removed and bytes freed.
+        """
+        count = 0
+        freed = 0
+        for blob in glob.glob(os.path.join(self.path(), '*', '*')):
+            st = os.lstat(blob)
+            if st.st_nlink == 1:
+                os.unlink(blob)
+                count += 1
+                freed += st.st_size
+        for dir in glob.glob(os.path.join(self.path(), '*')):
+            if os.path.isdir(dir) and not os.listdir(dir):
+                os.rmdir(dir)
+        return (count, freed)
@@ -1,17 +1,8 @@
-import sys
-import inspect
-import re
-import os
-import random
-import readline
-import glob
-import time
-import shutil
-import requests
 import json
 
 from .error import QError
-from .helper import Curl, SystemCall
+from .helper import Curl, SystemCall, Parallel
+from .connection import QConnection
 
 
 class BuildMixin:
@@ -49,6 +40,13 @@ class BuildMixin:
         """
         raise QError("Not implemented in %s: build_status().", self.__class__.__name__)
 
+    def build_status_many(self, tickets):
+        """
+        Fetch the build statuses of several tickets as a list in the same order.
+        A status is an exception or None, if it could not be resolved.
+        """
+        return Parallel(self.settings)(self.build_status, tickets, errors=True)
+
 
 class NoBuild(BuildMixin):
     """
@@ -86,27 +84,94 @@ class BuildByBamboo(BuildMixin):
         ret = {}
         for plan in self.settings.BAMBOO_PLANS.split("\n"):
             url = self.settings.BAMBOO_URL + "rest/api/latest/queue/%s.json?customRevision=%s" % (plan, gitid)
-            resp = requests.post(url, auth=self._build_auth(), verify=False)
+            resp = QConnection(self.settings).request('POST', url, auth=self._build_auth(), verify=False)
             data = resp.json()
             ret[data['planKey']] = data['buildNumber']
         return json.dumps(ret)
 
+    # Number of the latest results fetched when listing the results of a plan.
+    BAMBOO_RESULTS = 25
+
     def build_status(self, ticket):
         builds = json.loads(ticket['Build ID'])
+        return self._build_result(builds, self._build_states(builds.items()))
+
+    def build_status_many(self, tickets):
+        """
+        Fetch the build statuses of the tickets looking up all their plan results at once.
+        """
+        builds = []
+        for ticket in tickets:
+            try:
+                builds.append(json.loads(ticket['Build ID']))
+            except ValueError as e:
+                builds.append(e)
+        pairs = set()
+        for build in builds:
+            if isinstance(build, dict):
+                pairs.update(build.items())
+        states = self._build_states(pairs)
+        ret = []
+        for build in builds:
+            try:
+                ret.append(build if isinstance(build, Exception) else self._build_result(build, states))
+            except (QError, Exception) as e:
+                ret.append(e)
+        return ret
+
+    def _build_get(self, url):
+        """
+        Get the JSON data from Bamboo.
+        """
+        resp = QConnection(self.settings).request('GET', url, auth=self._build_auth(), verify=False)
+        try:
+            return resp.json()
+        except ValueError:
+            raise QError('Getting status from %s failed: %s', url, resp.text)
+
+    def _build_states(self, pairs):
+        """
+        Look up the states of the results given as (plan, build number) pairs.
+
+        Plans having several results asked are listed with their latest results first and the
+        results still missing are fetched one by one, all concurrently. Returns a dictionary
+        from pairs to states or exceptions.
+        """
+        numbers = {}
+        for plan, number in pairs:
+            numbers.setdefault(plan, set()).add(number)
+
+        def listing(plan):
+            url = self.settings.BAMBOO_URL + "rest/api/latest/result/%s.json?max-results=%d&includeAllStates=true" % (plan, self.BAMBOO_RESULTS)
+            data = self._build_get(url)
+            return dict(((plan, result['buildNumber']), result['state']) for result in data['results']['result'])
+
+        def single(pair):
+            url = self.settings.BAMBOO_URL + "rest/api/latest/result/%s/%s.json" % pair
+            return self._build_get(url)['state']
+
+        states = {}
+        listed = [plan for plan in numbers if len(numbers[plan]) > 1]
+        for found in Parallel(self.settings)(listing, listed, errors=True):
+            if isinstance(found, dict):
+                states.update(found)
+        missing = [(plan, number) for plan in numbers for number in numbers[plan] if (plan, number) not in states]
+        for pair, state in zip(missing, Parallel(self.settings)(single, missing, errors=True)):
+            states[pair] = state
+        return states
+
+    def _build_result(self, builds, states):
+        """
+        Combine the states of the plan results of a build to the build status.
+        """
         success = 0
         fail = 0
         total = 0
         for plan in builds.keys():
             total += 1
-            url = self.settings.BAMBOO_URL + "rest/api/latest/result/%s/%s.json" % (plan, builds[plan])
-            try:
-                resp = requests.get(url, auth=self._build_auth(), verify=False)
-                data = resp.json()
-            except Exception as e:
-                print (resp)
-                print (e)
-                raise QError('Getting status failed.')
-            state = data['state']
+            state = states.get((plan, builds[plan]))
+            if isinstance(state, BaseException):
+                raise state
             if state == 'Successful':
                 success += 1
             elif state == 'Unknown':
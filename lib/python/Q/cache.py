@@ -1,40 +1,223 @@
 import os
 import time
+import atexit
 import pickle
-from .settings import QSettings
+import threading
+
+from .error import QError
+from .profiling import QProfile
+
 
 class QCache:
     """
     A cache for storing network intensive result queries.
+
+    Entries are grouped by a namespace, which has its own caching time. There is one
+    instance per cache file in the process. It is loaded on the first use and all
+    changes are written back once at exit.
     """
 
+    # Shared instances by the path of the cache file.
+    instances = {}
+
     def __init__(self, settings):
         self.cache = None
         self.settings = settings
+        self.dirty = False
+        self.lock = threading.RLock()
+        # Namespaces having failed queries during this run.
+        self.failing = {}
+
+    @classmethod
+    def instance(cls, settings):
+        """
+        Get the shared cache instance for the project.
+        """
+        path = os.path.join(settings.APPDIR, '.q.cache')
+        if path not in cls.instances:
+            if not cls.instances:
+                atexit.register(cls.flush_all)
+            cls.instances[path] = QCache(settings)
+        return cls.instances[path]
+
+    @classmethod
+    def flush_all(cls):
+        """
+        Write all changed caches.
+        """
+        for cache in cls.instances.values():
+            try:
+                cache.save()
+            except (IOError, OSError):
+                pass
 
-    def get(self, id, fn):
+    def ttl(self, namespace, default=None):
+        """
+        Caching time in seconds for the namespace. The default is in minutes and replaces
+        CACHING_TIME_MIN, when the namespace is not listed in CACHING_TIMES.
+        """
+        if self.settings.CACHING_TIMES:
+            for line in str(self.settings.CACHING_TIMES).split("\n"):
+                parts = line.split('=')
+                if len(parts) == 2 and parts[0].strip() == namespace:
+                    return float(parts[1]) * 60
+        if default is not None:
+            return float(default) * 60
+        return float(self.settings.CACHING_TIME_MIN) * 60
+
+    def is_fresh(self, entry):
+        """
+        Check if the entry has not yet expired.
+        """
+        if 'error' in entry:
+            ttl = float(self.settings.CACHING_FAILURE_TIME_MIN) * 60
+        else:
+            ttl = self.ttl(entry['namespace'], entry.get('ttl'))
+        return time.time() - entry['time'] <= ttl
+
+    def lookup(self, namespace, key):
+        """
+        Get the fresh entry for the key or None. The entry has either 'value' or 'error' set.
+        """
+        with self.lock:
+            if self.cache is None:
+                self.load()
+            entry = self.cache.get((namespace, key))
+            if entry is None or not self.is_fresh(entry):
+                return None
+            return entry
+
+    @QProfile.timed(lambda self, namespace, key, fn: 'QCache.get ' + namespace)
+    def get(self, namespace, key, fn):
+        """
+        Get the value for the key, calling the function to resolve it, if not cached.
+
+        A failure is cached as well and None is returned for it. After the first failure
+        of the namespace, no more queries are made for it during this run.
+        """
         if self.settings.OFFLINE_MODE:
             return None
-        if self.cache is None:
-            self.load()
-        if id not in self.cache or (time.time() - self.cache[id]['time']) / 60 > int(self.settings.CACHING_TIME_MIN):
-            self.cache[id] = {
-                "time": time.time(),
-                "value": fn()
-            }
-            self.save()
-        return self.cache[id]['value']
+        entry = self.lookup(namespace, key)
+        if entry is None:
+            if namespace in self.failing:
+                return None
+            try:
+                value = fn()
+            except (QError, Exception) as e:
+                self.fail(namespace, key, e)
+                return None
+            self.put(namespace, key, value)
+            return value
+        return entry.get('value')
+
+    @QProfile.timed(lambda self, namespace, keys, fn: 'QCache.get_many ' + namespace)
+    def get_many(self, namespace, keys, fn):
+        """
+        Get the values for several keys resolving all not cached at once with the function.
+
+        The function is called with the list of missing keys and returns a list of their values
+        in the same order. A value being an exception or None is cached as a failure of its key.
+        """
+        if self.settings.OFFLINE_MODE:
+            return {}
+        ret = {}
+        missing = []
+        for key in keys:
+            entry = self.lookup(namespace, key)
+            if entry is None:
+                missing.append(key)
+            else:
+                ret[key] = entry.get('value')
+        if not missing or namespace in self.failing:
+            return ret
+        try:
+            values = fn(missing)
+        except (QError, Exception) as e:
+            for key in missing:
+                self.fail(namespace, key, e)
+            return ret
+        for key, value in zip(missing, values):
+            if isinstance(value, BaseException):
+                self.fail(namespace, key, value)
+            elif value is None:
+                self.store(namespace, key, {'error': 'No result.'})
+            else:
+                self.put(namespace, key, value)
+                ret[key] = value
+        return ret
+
+    def put(self, namespace, key, value, ttl=None):
+        """
+        Store a value for the key. The caching time in minutes can be given for the entry.
+        """
+        entry = {'value': value}
+        if ttl is not None:
+            entry['ttl'] = ttl
+        self.store(namespace, key, entry)
+
+    def fail(self, namespace, key, error):
+        """
+        Store a failure for the key and stop querying the namespace for this run.
+        """
+        from .q import Q
+        with self.lock:
+            if namespace not in self.failing:
+                Q.wr('Cache', Q.ERROR + 'Query %s %s failed: %s' + Q.END, namespace, key, error)
+            self.failing[namespace] = str(error)
+        self.store(namespace, key, {'error': str(error)})
+
+    def store(self, namespace, key, entry):
+        with self.lock:
+            if self.cache is None:
+                self.load()
+            entry['namespace'] = namespace
+            entry['time'] = time.time()
+            self.cache[(namespace, key)] = entry
+            self.dirty = True
 
     def path(self):
         return os.path.join(self.settings.APPDIR, '.q.cache')
 
+    def evict(self):
+        """
+        Drop expired entries and the oldest ones exceeding the maximum size.
+        """
+        for k in list(self.cache.keys()):
+            if not self.is_fresh(self.cache[k]):
+                del self.cache[k]
+        limit = int(self.settings.CACHING_MAX_ENTRIES)
+        if len(self.cache) > limit:
+            keys = sorted(self.cache.keys(), key=lambda k: self.cache[k]['time'])
+            for k in keys[0:len(keys) - limit]:
+                del self.cache[k]
+
     def save(self):
-        with open(self.path(), 'wb') as output:
-            pickle.dump(self.cache, output, pickle.HIGHEST_PROTOCOL)
+        """
+        Merge changes with the file content and write it atomically, if anything has changed.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            mine = self.cache
+            self.load()
+            for k in mine:
+                if k not in self.cache or self.cache[k]['time'] < mine[k]['time']:
+                    self.cache[k] = mine[k]
+            self.evict()
+            tmp = self.path() + '.tmp'
+            with open(tmp, 'wb') as output:
+                pickle.dump(self.cache, output, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path())
+            self.dirty = False
 
     def load(self):
         try:
             with open(self.path(), 'rb') as input:
-                self.cache = pickle.load(input)
-        except IOError:
+                data = pickle.load(input)
+            self.cache = {}
+            for k in data:
+                # Skip anything not written by this version.
+                if isinstance(data[k], dict) and 'namespace' in data[k] and 'time' in data[k]:
+                    self.cache[k] = data[k]
+        except (IOError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
             self.cache = {}
@@ -1,8 +1,12 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import glob
+import importlib
 from .error import QError
 from .ticket import Ticket
+from .profiling import QProfile
+from .blobs import QBlobs
 from .helper import *
 
 
@@ -31,6 +35,11 @@ class Command:
 
     param_aliases = {}
 
+    # Names of the commands each implemented in the module of the same name under commands.
+    names = ['backport', 'base', 'build', 'cancel', 'commit', 'create', 'daemon', 'destroy', 'diff', 'done', 'edit',
+             'epic', 'find', 'gc', 'go', 'help', 'last', 'link', 'ls', 'my', 'offline', 'open', 'prefetch', 'publish',
+             'release', 'reopen', 'review', 'settings', 'show', 'start', 'test', 'update', 'url', 'work']
+
     def __init__(self, app):
         self.app = app
         self.settings = app.settings
@@ -67,6 +76,7 @@ class Command:
                 if matches[len(matches)-1] == str:
                     return code
 
+    @QProfile.timed(lambda self, *argv: 'Command ' + self.__class__.__name__[7:].lower())
     def parse(self, *argv):
         """
         Parse options and run the command.
@@ -162,14 +172,15 @@ class Command:
     @staticmethod
     def find(cmd):
         """
-        Find the command implementation class.
+        Find the command implementation class importing only its own module.
         """
         if cmd in Command.aliases:
             cmd = Command.aliases[cmd]
-        all = Command.all_commands()
-        if cmd in all:
-            return all[cmd]
-        return None
+        if cmd not in Command.names:
+            return None
+        package = __name__.rpartition('.')[0]
+        module = importlib.import_module(package + '.commands.' + cmd)
+        return getattr(module, 'Command' + cmd.capitalize())
 
     @staticmethod
     def all_commands():
@@ -177,44 +188,8 @@ class Command:
         Collect a map from all command names to their classes.
         """
         ret = {}
-        from commands.backport import CommandBackport
-        from commands.base import CommandBase
-        from commands.build import CommandBuild
-        from commands.cancel import CommandCancel
-        from commands.commit import CommandCommit
-        from commands.create import CommandCreate
-        from commands.destroy import CommandDestroy
-        from commands.diff import CommandDiff
-        from commands.done import CommandDone
-        from commands.edit import CommandEdit
-        from commands.epic import CommandEpic
-        from commands.find import CommandFind
-        from commands.go import CommandGo
-        from commands.help import CommandHelp
-        from commands.last import CommandLast
-        from commands.link import CommandLink
-        from commands.ls import CommandLs
-        from commands.my import CommandMy
-        from commands.offline import CommandOffline
-        from commands.open import CommandOpen
-        from commands.publish import CommandPublish
-        from commands.release import CommandRelease
-        from commands.reopen import CommandReopen
-        from commands.review import CommandReview
-        from commands.settings import CommandSettings
-        from commands.show import CommandShow
-        from commands.start import CommandStart
-        from commands.test import CommandTest
-        from commands.update import CommandUpdate
-        from commands.url import CommandUrl
-        from commands.work import CommandWork
-
-        for name in ['Destroy', 'Help', 'Ls', 'Show', 'Start', 'Go', 'My', 'Diff', 'Commit', 'Settings', 'Publish',
-                     'Update', 'Edit', 'Backport', 'Done', 'Build', 'Review', 'Release', 'Create', 'Reopen',
-                     'Cancel', 'Test', 'Find', 'Base', 'Open', 'Url', 'Last', 'Offline',
-                     'Epic', 'Work', 'Link']:
-            ret[name.lower()] = eval("Command" + name)
-
+        for name in Command.names:
+            ret[name] = Command.find(name)
         return ret
 
 
@@ -274,7 +249,9 @@ class CommandDb(AutoLoadCommand):
 
     def run(self):
         """
-        usage: q db [<code>] save [<dump_file>[.sql]] | init <ticket_number> | init <db_name> | reset | open
+        usage: q db [<code>] save [<dump_file>[.sql[.gz]]] | load [<dump_file>[.sql[.gz]]] | init <ticket_number> | init <db_name> | init <dump_file> | reset | open
+
+        Dumps are stored compressed, unless the name given ends with `.sql`.
         """
         from q import Q
         if len(self.args)==0:
@@ -291,15 +268,15 @@ class CommandDb(AutoLoadCommand):
                     self.wr(Q.TITLE+"Ticket's DB:"+Q.END)
                     self.wr(conf_db)
                 self.wr(Q.TITLE+"Dumps:"+Q.END)
-                for dump in glob.glob(self.ticket.path('*.sql')):
+                for dump in sorted(glob.glob(self.ticket.path('*.sql')) + glob.glob(self.ticket.path('*.sql.gz'))):
                     if dump == self.ticket['Dump']:
                         dump += " "+Q.MARK
                     self.wr(dump)
                 self.wr(Q.TITLE+"Help:"+Q.END)
                 self.wr("Use "+Q.COMMAND+"q db init <ticket_number>"+Q.END+" or "+Q.COMMAND+"q db init <db_name>"+Q.END+" to recreate.")
-                self.wr("Use "+Q.COMMAND+"q db save [<dump_file>[.sql]]"+Q.END+" to save a dump.")
-                self.wr("Use "+Q.COMMAND+"q db load [<dump_file>[.sql]]"+Q.END+" to load a dump.")
-                self.wr("Use "+Q.COMMAND+"q db reset"+Q.END+" start from the scratch.")
+                self.wr("Use "+Q.COMMAND+"q db save [<dump_file>[.sql[.gz]]]"+Q.END+" to save a dump.")
+                self.wr("Use "+Q.COMMAND+"q db load [<dump_file>[.sql[.gz]]]"+Q.END+" to load a dump.")
+                self.wr("Use "+Q.COMMAND+"q db reset"+Q.END+" to go back to the state of the dump or start from the scratch.")
                 self.wr("Use "+Q.COMMAND+"q db open"+Q.END+" to access it with command-line client.")
                 return
 
@@ -307,12 +284,14 @@ class CommandDb(AutoLoadCommand):
             if(len(self.args) > 1):
                 dump_name = self.args[1]
             else:
-                dump_name = 'dump.sql'
-            if dump_name[-4:]!='.sql':
-                dump_name += '.sql'
+                dump_name = 'dump'
+            if not dump_name.endswith(('.sql', '.sql.gz')):
+                dump_name += '.sql.gz'
             db = self.app.db_info()
             dump_path = self.ticket.path(dump_name)
             Mysql().save(db, dump_path)
+            QBlobs(self.settings).store(dump_path)
+            self.app.db_snapshot(db, dump_path)
             self.ticket['Dump']=dump_path
             self.ticket['DB']=db['db']
             self.ticket.save()
@@ -323,8 +302,13 @@ class CommandDb(AutoLoadCommand):
                 dump_path = self.ticket.path(self.args[1])
             else:
                 dump_path = self.ticket['Dump']
-            if dump_path[-4:]!='.sql':
-                dump_path += '.sql'
+            if not dump_path:
+                raise QError("No dump saved for the ticket.")
+            if not dump_path.endswith(('.sql', '.sql.gz')):
+                if os.path.isfile(dump_path + '.sql'):
+                    dump_path += '.sql'
+                else:
+                    dump_path += '.sql.gz'
             if not os.path.isfile(dump_path):
                 raise QError("Cannot find dump '%s'.", dump_path)
             info = self.app.db_info()
@@ -333,7 +317,8 @@ class CommandDb(AutoLoadCommand):
 
         elif self.args[0] == 'init':
             info = self.app.db_info()
-            init_path = self.ticket.path("init.sql")
+            init_path = self.ticket.path("init.sql.gz")
+            dump_path = None
             if len(self.args)==1:
                 self.wr("Creating empty database.")
                 init_path = None
@@ -344,21 +329,31 @@ class CommandDb(AutoLoadCommand):
                     raise QError("Cannot find dump file for ticket '%s'.",self.args[1])
                 dump_path = ticket['Dump']
                 self.wr("Copying DB from '%s' to '%s'.", dump_path, init_path)
-                shutil.copyfile(dump_path, init_path)
             elif os.path.exists(self.args[1]):
                 dump_path=self.args[1]
                 self.wr("Copying DB from '%s' to '%s'.", dump_path, init_path)
-                if dump_path[-3:] == '.gz':
-                    Zcat()(dump_path, '>', init_path)
-                else:
-                    shutil.copyfile(dump_path, init_path)
             else:
                 info['db'] = self.args[1]
                 Mysql().save(info, init_path)
             info['db'] = self.settings.DB_NAME % self.ticket.code
-            Mysql().create(info)
+            blobs = QBlobs(self.settings)
+            if dump_path and dump_path.endswith('.sql.gz') and blobs.link(dump_path, init_path):
+                dump_path = None
+            if dump_path:
+                # Load straight from the source storing the compressed copy on the way.
+                Mysql().create(info)
+                Mysql().load(info, dump_path, keep=init_path)
+                blobs.store(init_path)
+                self.app.db_snapshot(info, init_path)
+            elif init_path:
+                blobs.store(init_path)
+                if not self.app.db_restore(info, init_path):
+                    Mysql().create(info)
+                    Mysql().load(info, init_path)
+                    self.app.db_snapshot(info, init_path)
+            else:
+                Mysql().create(info)
             if init_path:
-                 Mysql().load(info, init_path)
                  self.ticket['Dump']=init_path
             self.ticket['DB']=info['db']
             self.ticket.save()
@@ -367,13 +362,16 @@ class CommandDb(AutoLoadCommand):
         elif self.args[0] == 'reset':
 
             db_name = self.settings.DB_NAME % self.ticket.code
-            self.app.db_reset()
-            save_path = self.ticket.path("empty.sql")
-            self.ticket['Dump']=save_path
+            dump_path = self.ticket['Dump']
+            if dump_path and os.path.isfile(dump_path) and self.app.db_restore(self.app.db_info(), dump_path):
+                self.wr("Restored the pristine copy of '%s'.", dump_path)
+            else:
+                self.app.db_reset()
+                self.ticket['Dump']=self.ticket.path("empty.sql")
             self.ticket['DB']=db_name
             self.ticket.save()
 
-        if self.args[0] == 'open':
+        elif self.args[0] == 'open':
             if not self.ticket['DB']:
                 raise QError("Cannot open DB since none in use.")
             Mysql().open(self.app.db_info())
@@ -30,6 +30,7 @@ class CommandCommit(AutoGoCommand):
         for file in missing:
             self.wr('New file: ' + Q.FILE + file + Q.END)
         self.wr('Empty line to abort:')
+        import readline
         comments = raw_input()
         if not comments:
             self.wr('Aborted.')
@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+import os
+import signal
+
+from ..error import QError
+from ..command import Command
+from ..daemon import QDaemon
+
+
+class CommandDaemon(Command):
+    """
+    Run a background server making the commands listing and showing tickets start faster.
+    """
+    def run(self):
+        """
+        usage: q daemon [stop|status]
+        """
+        from ..q import Q
+        pid = QDaemon.pid()
+        if len(self.args) == 0:
+            if pid:
+                raise QError("Daemon is already running as process %d.", pid)
+            QDaemon().serve()
+        elif self.args[0] == 'stop':
+            if not pid:
+                raise QError("Daemon is not running.")
+            os.kill(pid, signal.SIGTERM)
+        elif self.args[0] == 'status':
+            if pid:
+                self.wr("Running as process %d on " + Q.FILE + "%s" + Q.END + ".", pid, QDaemon.path())
+            else:
+                self.wr("Not running.")
+        else:
+            raise QError("Invalid daemon sub-command '%s'.", self.args[0])
@@ -1,11 +1,15 @@
 # -*- coding: UTF-8 -*-
+import os
 import time
 import re
+import sqlite3
+from collections import OrderedDict
 
 from ..error import QError
 from ..command import Command
 from ..helper import Grep
 from ..ticket import Ticket
+from ..search import QSearch
 
 
 class CommandFind(Command):
@@ -14,13 +18,41 @@ class CommandFind(Command):
     """
     def run(self):
         """
-        usage: q find [search...]
+        usage: q find [--all] [search...]
         """
-        from ..q import Q
-
         args = " ".join(self.args)
         if args == "":
             raise QError("Need arguments to search.")
+        if 'all' in self.opts:
+            hits = self.grep(args)
+        else:
+            try:
+                hits = self.search(args)
+            except (sqlite3.Error, OSError) as e:
+                self.wr("Search index not available (%s), using grep.", e)
+                hits = self.grep(args)
+        if len(hits) == 0:
+            self.wr("Not found")
+        else:
+            self.show(hits)
+
+    def search(self, args):
+        """
+        Look up the ranked hits from the search index.
+        """
+        search = QSearch(self.settings)
+        hits = OrderedDict()
+        for score, rel in search.search(self.app.all_codes(), args):
+            ticket = rel[0:rel.find('/')]
+            if ticket not in hits:
+                hits[ticket] = OrderedDict()
+            hits[ticket][os.path.join(self.settings.WORKDIR, rel)] = search.context(rel, args)
+        return hits
+
+    def grep(self, args):
+        """
+        Search all files of the tickets including dumps using grep.
+        """
         args = '"' + args.replace('"', '\\"') + '"'
         out = Grep().run("-r", "-l", "-i", args, self.settings.WORKDIR, get_output=True)
         hits = {}
@@ -36,12 +68,13 @@ class CommandFind(Command):
                 hits[ticket] = {}
             grep = Grep().run("-A2", "-B2", "-i", args, filename, get_output=True)
             hits[ticket][filename] = grep
-        if len(hits) == 0:
-            self.wr("Not found")
-        else:
-            for ticket in hits:
-                self.load(ticket)
-                self.wr(Q.TITLE + ticket + ' - ' + self.ticket['Title'] + Q.END + "\n")
-                for filename in hits[ticket]:
-                    self.wr(Q.URL + filename + Q.END + "\n")
-                    self.wr(hits[ticket][filename])
+        return hits
+
+    def show(self, hits):
+        from ..q import Q
+        for ticket in hits:
+            self.load(ticket)
+            self.wr(Q.TITLE + ticket + ' - ' + self.ticket['Title'] + Q.END + "\n")
+            for filename in hits[ticket]:
+                self.wr(Q.URL + filename + Q.END + "\n")
+                self.wr(hits[ticket][filename])
@@ -0,0 +1,24 @@
+# -*- coding: UTF-8 -*-
+from ..command import Command
+from ..blobs import QBlobs
+from ..database import DatabaseMixin
+
+
+class CommandGc(Command):
+    """
+    Share identical dumps and diffs of the tickets and remove the stored copies and database snapshots no longer used.
+    """
+    def run(self):
+        """
+        usage: q gc
+        """
+        from ..q import Q
+        blobs = QBlobs(self.settings)
+        files, saved = blobs.adopt(self.app.all_codes())
+        count, freed = blobs.collect()
+        self.wr(Q.TITLE + "Stored files:" + Q.END + " %d", files)
+        self.wr(Q.TITLE + "Saved by sharing:" + Q.END + " %.1f MB", saved / 1048576.0)
+        self.wr(Q.TITLE + "Unused removed:" + Q.END + " %d (%.1f MB)", count, freed / 1048576.0)
+        if isinstance(self.app, DatabaseMixin):
+            dropped = self.app.db_drop_snapshots(blobs.digests(self.app.all_codes()))
+            self.wr(Q.TITLE + "Unused database snapshots removed:" + Q.END + " %d", dropped)
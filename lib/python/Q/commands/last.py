@@ -22,30 +22,30 @@ class CommandLast(Command):
             LIMIT = str(datetime.date.today() + datetime.timedelta(days=-7))
 
         results = {}
-        for code in self.app.all_codes():
-            self.load(code)
-            if self.ticket['Finished'] is None:
+        for ticket in self.app.all_tickets():
+            code = ticket.code
+            if ticket['Finished'] is None:
                 continue
-            started = self.ticket['Started'][0:10]
+            started = ticket['Started'][0:10]
             finished = None
-            if self.ticket['Status'] == 'Done':
-                finished = self.ticket['Finished'][0:10]
+            if ticket['Status'] == 'Done':
+                finished = ticket['Finished'][0:10]
 
             if finished == started and started >= LIMIT:
                 if started not in results:
                     results[started] = []
-                results[started].append(code + ' ' + self.ticket['Title'] + Q.MAGENTA + ' [Started and Finished]' + Q.END)
+                results[started].append(code + ' ' + ticket['Title'] + Q.MAGENTA + ' [Started and Finished]' + Q.END)
             else:
                 if finished >= LIMIT:
                     if finished not in results:
                         results[finished] = []
                     else:
-                        results[finished].append(code + ' ' + self.ticket['Title'] + Q.GREEN + ' [Finished]' + Q.END)
+                        results[finished].append(code + ' ' + ticket['Title'] + Q.GREEN + ' [Finished]' + Q.END)
 
                 if started >= LIMIT:
                     if started not in results:
                         results[started] = []
-                    results[started].append(code + ' ' + self.ticket['Title'] + Q.YELLOW + ' [Started]' + Q.END)
+                    results[started].append(code + ' ' + ticket['Title'] + Q.YELLOW + ' [Started]' + Q.END)
 
         for title in sorted(results.keys()):
             self.wr(Q.TITLE + "\n" + title + Q.END + "\n")
@@ -87,21 +87,18 @@ class CommandLs(Command):
         working = []
         done_but_current = []
         show_all = self.opts.get('all')
-        codes = self.app.all_codes()
-        codes.sort(reverse = True)
+        tickets = self.app.all_tickets()
+        tickets.sort(key=lambda t: t.code, reverse=True)
         # Run separate refresh round to get prints out of the listing.
-        for code in codes:
-            self.load(code)
-            self.ticket.refresh()
+        Ticket.refresh_all(tickets)
         # Separate them to old and current tickets.
-        for code in codes:
-            self.load(code)
-            if self.ticket.finished():
-                done.append(self.ticket)
-                if (self.ticket.code == current):
-                    done_but_current.append(self.ticket)
+        for ticket in tickets:
+            if ticket.finished():
+                done.append(ticket)
+                if (ticket.code == current):
+                    done_but_current.append(ticket)
             else:
-                working.append(self.ticket)
+                working.append(ticket)
 
         if len(done) + len(working) == 0:
             self.wr("No tickets created.", channel='Help')
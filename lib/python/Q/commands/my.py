@@ -47,6 +47,7 @@ class CommandMy(Command):
         elif self.args[0] == "save":
             Git(self.settings)('--no-pager diff --color')
             self.wr("Record these changes as private. Are you sure (y/n)?")
+            import readline
             resp = raw_input()
             if resp!='y':
                 self.wr("Canceled")
@@ -0,0 +1,22 @@
+# -*- coding: UTF-8 -*-
+from ..command import Command
+
+
+class CommandPrefetch(Command):
+    """
+    Store the tickets assigned to me locally, so that starting them needs no ticketing queries.
+    """
+    def run(self):
+        """
+        usage: q prefetch [<code>...]
+               <code> - Store these tickets in addition to the ones stored before instead of my assigned tickets.
+        """
+        from ..q import Q
+        if self.args:
+            tickets = [ticket for ticket in self.app.fetch_tickets(self, self.args) if ticket]
+        else:
+            tickets = self.app.prefetch_tickets(self)
+        self.app.save_prefetched(tickets, replace=not self.args)
+        for ticket in tickets:
+            self.wr(Q.VAR + ticket.code + Q.END + ' ' + (ticket['Title'] or ''))
+        self.wr(Q.TITLE + "Tickets stored:" + Q.END + " %d", len(tickets))
@@ -4,6 +4,7 @@ import time
 from ..error import QError
 from ..command import AutoGoCommand
 from ..helper import Git
+from ..blobs import QBlobs
 
 
 class CommandReview(AutoGoCommand):
@@ -110,6 +111,7 @@ class CommandReview(AutoGoCommand):
         version = self.ticket.reviews() + 1
         file = self.ticket.path("review-"+str(version)+".diff")
         Git(self.settings)('diff '+merge_base+" > "+file)
+        QBlobs(self.settings).store(file)
         return file
 
     def run_update(self):
@@ -41,7 +41,7 @@ class CommandShow(AutoLoadCommand):
             basename = os.path.split(f)[-1]
             if basename[0:7]=='review-' and basename[-5:]=='.diff':
                 continue
-            if f[-1] != '~' and f[-4:] != '.sql' and basename not in std_files:
+            if f[-1] != '~' and not f.endswith(('.sql', '.sql.gz')) and basename not in std_files:
                 files.append(f)
         if files:
             self.wr('Additional Files:')
@@ -20,7 +20,8 @@ class CommandStart(Command):
                <code> - A ticket number.
                <title> - A descriptive title of the ticket.
 
-               If title is not given, then data is fetched from the remote ticketing.
+               If title is not given, then data is taken from the tickets stored by `q prefetch`
+               or fetched from the remote ticketing.
         """
         from ..q import Q
         if not self.code:
@@ -39,7 +40,7 @@ class CommandStart(Command):
                 str += '.'
             self.ticket['Title'] = str
         else:
-            self.ticket = self.app.fetch_ticket(self, self.code)
+            self.ticket = self.app.prefetched_ticket(self.code) or self.app.fetch_ticket(self, self.code)
             if not self.ticket:
                 raise QError("Ticketing system failed to get the ticket.")
         self.ticket['Branch'] = None
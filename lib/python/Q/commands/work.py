@@ -22,7 +22,7 @@ class CommandWork(AutoLoadCommand):
 
     def run(self):
         """
-        usage: q work [--today|on [<time>]|off [<time>]|push|switch|merge|comment|drop|reopen]
+        usage: q work [--today|on [<time>]|off [<time>]|push [<code>|<date>] [--dry]|switch|merge|comment|drop|reopen]
         """
         if not self.app.timing_is_in_use():
             return
@@ -58,25 +58,25 @@ class CommandWork(AutoLoadCommand):
         Display current list.
         """
         from ..q import Q
-        log = self.app.timing_get_full_list()
+        from ..timing import work_totals
+        if today:
+            log = self.app.timing_get_full_list(date=strftime('%Y-%m-%d', localtime()))
+        else:
+            log = self.app.timing_get_full_list()
+        totals = work_totals(log)[0]
         last_date = None
 
-        sum = 0
-        left = 0
-        def show_sum():
+        def show_sum(sum):
             self.wr(Q.GREEN + "              Total: %.2fh" % sum + Q.END)
             left = float(self.settings.WORK_HOURS) - sum
             if left:
                 self.wr(Q.GREEN + "              Left: %.2fh (%d min)" % (left, left * 60) + Q.END)
         for e in log:
             date, time = e.start.split(' ')
-            if today and date != log[0].today():
-                continue
             if date != last_date:
+                if last_date is not None and totals[last_date]:
+                    show_sum(totals[last_date] / 60)
                 last_date = date
-                if sum:
-                    show_sum()
-                sum = 0
                 self.wr(Q.DATE + date + Q.END)
             if e.stop:
                 date2, time2 = e.stop.split(' ')
@@ -84,8 +84,8 @@ class CommandWork(AutoLoadCommand):
                 time2 = '        '
             text = '' if e.text is None else e.text
             self.wr(Q.TIME + time[0:5] + ' - ' + time2[0:5] + ' ' +  Q.END + e.code + '\t' + e.human() + '  ' + text)
-            sum += e.minutes() / 60
-        show_sum()
+        sum = totals.get(last_date, 0) / 60
+        show_sum(sum)
         left = float(self.settings.WORK_HOURS) - sum
         if left:
             self.wr(Q.GREEN + "              Done: %s" % str(datetime.now() + timedelta(hours=left))[11:11 + 5] + Q.END)
@@ -151,9 +151,14 @@ class CommandWork(AutoLoadCommand):
             log = self.app.timing_get_full_list(date = date)
             for w in log:
                 codes.add(w.code)
+        projects = {}
         for code in codes:
-            self.load(code)
-            self.app.timing_push_ticket(self.ticket)
+            app = self.app.q.find_project(code)
+            if app is None:
+                raise QError('Unable to find project for ticket code %r.' % code)
+            projects.setdefault(app, []).append(app.load_ticket(code))
+        for app in projects:
+            app.timing_push_tickets(projects[app], dry='dry' in self.opts)
 
     def run_switch(self):
         """
@@ -0,0 +1,58 @@
+import threading
+from urlparse import urlparse
+
+from .error import QError
+from .profiling import QProfile
+
+
+class QConnection:
+    """
+    Shared HTTP sessions for the backends.
+
+    There is one pooled session per scheme and host in the process, so that consecutive and
+    concurrent calls to the same server reuse connections, cookies and authentication.
+    Idempotent requests failing with connection errors or server errors are retried with
+    exponential backoff.
+    """
+
+    # Sessions by scheme and host.
+    sessions = {}
+    lock = threading.Lock()
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def session(self, url):
+        """
+        Get the shared session for the host of the URL.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        try:
+            from urllib3.util.retry import Retry
+        except ImportError:
+            from requests.packages.urllib3.util.retry import Retry
+        parts = urlparse(url)
+        key = (parts.scheme, parts.netloc)
+        with QConnection.lock:
+            if key not in QConnection.sessions:
+                retry = Retry(total=int(self.settings.HTTP_RETRIES), backoff_factor=float(self.settings.HTTP_BACKOFF),
+                              status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+                size = max(int(self.settings.PARALLEL_THREADS), 1)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retry)
+                session = requests.Session()
+                session.mount(parts.scheme + '://', adapter)
+                QConnection.sessions[key] = session
+            return QConnection.sessions[key]
+
+    @QProfile.timed(lambda self, method, url, **kwargs: 'HTTP ' + method + ' ' + urlparse(url).netloc)
+    def request(self, method, url, **kwargs):
+        """
+        Make a HTTP-request using the shared session and return the response.
+        """
+        import requests
+        kwargs.setdefault('timeout', float(self.settings.HTTP_TIMEOUT))
+        try:
+            return self.session(url).request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise QError('HTTP %s %r failed: %s', method, url, e)
@@ -0,0 +1,237 @@
+import os
+import sys
+import errno
+import socket
+import struct
+import marshal
+import signal
+
+
+class QDaemon:
+    """
+    Server running commands in forked copies of a process having all modules already imported.
+
+    The client sends the command line, working directory and environment over a Unix socket
+    together with its standard file descriptors, so that the forked worker writes directly to
+    the terminal of the client. The server keeps the settings and project classes of the seen
+    projects loaded. They are validated by modification times like the rest of the caches, so
+    no watching of the files is needed. Only the imports, settings and project classes stay warm
+    between the commands. Everything else a command loads is gone when its worker exits: the
+    result cache and the ticket index are written to their files and read back by the next
+    worker, and HTTP connections are opened again, since sockets cannot be shared safely by
+    forked processes.
+    """
+
+    # Commands and aliases run by the daemon. Others may start pagers, editors or other
+    # programs needing a controlling terminal, so they are run in the client process.
+    COMMANDS = ('f', 'find', 'help', 'last', 'ls', 's', 'show', '?')
+
+    @staticmethod
+    def path():
+        """
+        Get the path of the socket.
+        """
+        return os.environ.get('Q_DAEMON_SOCKET') or os.path.expanduser('~/.q.daemon')
+
+    @staticmethod
+    def send(conn, data):
+        conn.sendall(struct.pack('!I', len(data)) + data)
+
+    @staticmethod
+    def recv(conn):
+        header = QDaemon.recv_exactly(conn, 4)
+        return QDaemon.recv_exactly(conn, struct.unpack('!I', header)[0])
+
+    @staticmethod
+    def recv_exactly(conn, size):
+        data = ''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError('Connection closed.')
+            data += chunk
+        return data
+
+    @staticmethod
+    def call(argv):
+        """
+        Run the command in the daemon and return its exit status or None if it has to be run here.
+        """
+        if (argv[0] if argv else 'ls') not in QDaemon.COMMANDS:
+            return None
+        from _multiprocessing import sendfd
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(QDaemon.path())
+        except socket.error:
+            return None
+        try:
+            QDaemon.send(conn, marshal.dumps((os.getcwd(), list(argv), dict(os.environ))))
+            for fd in (0, 1, 2):
+                sendfd(conn.fileno(), fd)
+            pid = struct.unpack('!i', QDaemon.recv(conn))[0]
+            while True:
+                try:
+                    return struct.unpack('!i', QDaemon.recv(conn))[0]
+                except KeyboardInterrupt:
+                    os.kill(pid, signal.SIGINT)
+        except (socket.error, EOFError):
+            sys.stderr.write("Lost connection to the q daemon.\n")
+            return 1
+        finally:
+            conn.close()
+
+    @staticmethod
+    def pid():
+        """
+        Get the process ID of the running daemon or None.
+        """
+        try:
+            with open(QDaemon.path() + '.pid') as input:
+                pid = int(input.read())
+            os.kill(pid, 0)
+        except (IOError, OSError, ValueError):
+            return None
+        return pid
+
+    def preload(self):
+        """
+        Import everything the commands may need.
+        """
+        from .command import Command
+        from .project import QProject
+        import importlib
+        Command.all_commands()
+        for name in QProject.mixins:
+            QProject.mixin(name)
+        for module in ('requests', 'simplejson'):
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+
+    def warm(self, cwd):
+        """
+        Load the settings and the project classes for the directory to be inherited by the next workers.
+        """
+        from .settings import QSettings
+        from .project import QProject
+        QSettings.found.clear()
+        path = QSettings.find(cwd)
+        if not path:
+            return
+        settings = QSettings.load(path)
+        QProject.create(settings, None)
+        if settings.LINKED_PROJECTS:
+            for linked in settings.LINKED_PROJECTS.split(':'):
+                found = QSettings.find(linked.rstrip('/'))
+                if found:
+                    QProject.create(QSettings.load(found), None)
+
+    def serve(self):
+        """
+        Accept connections and run each command in a new worker process until stopped.
+        """
+        from _multiprocessing import recvfd
+        from .q import Q
+        self.preload()
+        path = QDaemon.path()
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0077)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        with open(path + '.pid', 'w') as output:
+            output.write(str(os.getpid()))
+        # Let the kernel reap the workers.
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        Q.wr('Daemon', 'Listening on %s.', path)
+        try:
+            while True:
+                try:
+                    conn = server.accept()[0]
+                except socket.error as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    cwd, argv, env = marshal.loads(QDaemon.recv(conn))
+                    fds = [recvfd(conn.fileno()) for i in range(3)]
+                except (socket.error, EOFError, ValueError, OSError):
+                    conn.close()
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    status = 1
+                    try:
+                        status = self.work(conn, cwd, argv, env, fds)
+                    finally:
+                        os._exit(status)
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+                try:
+                    self.warm(cwd)
+                except BaseException:
+                    pass
+        finally:
+            server.close()
+            for name in (path, path + '.pid'):
+                if os.path.exists(name):
+                    os.unlink(name)
+
+    def work(self, conn, cwd, argv, env, fds):
+        """
+        Run the command in the worker process with the standard files of the client.
+        """
+        from .q import Q
+        from .error import QError
+        from .settings import QSettings
+        from .helper import Git
+        from .cache import QCache
+        from .profiling import QProfile
+        for i in range(3):
+            os.dup2(fds[i], i)
+            os.close(fds[i])
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = ['q'] + argv
+        # Forget the state of the process running the daemon command.
+        Q.projects = []
+        Q.linked = []
+        Q.prev_channel = None
+        QSettings.found.clear()
+        QCache.instances = {}
+        Git.forget()
+        QDaemon.send(conn, struct.pack('!i', os.getpid()))
+        status = 0
+        argv = QProfile.setup(argv)
+        try:
+            q = Q(*argv)
+            q.parse(*argv)
+        except QError as e:
+            Q.wr('Fail', Q.ERROR + "ERROR: " + str(e) + Q.END)
+            status = 1
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        QProfile.finish()
+        # The worker leaves with os._exit(), which skips the exit handlers.
+        QCache.flush_all()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        QDaemon.send(conn, struct.pack('!i', status))
+        return status
@@ -1,11 +1,18 @@
+import re
+
 from .error import QError
 from .settings import QSettings
 from .helper import Mysql, Sed
+from .blobs import QBlobs
 
 
 class DatabaseMixin:
     """
     Base class for database handler mixins.
+
+    A pristine copy of the database loaded from each dump is kept as a snapshot database
+    named by the content hash of the dump, so that the same state can be restored later
+    by copying tables inside the server instead of replaying the dump.
     """
     def db_info(self):
         """
@@ -13,6 +20,12 @@ class DatabaseMixin:
         """
         raise QError("Not implemented %s: db_info().", self.__class__.__name__)
 
+    def change_db(self, db):
+        """
+        Switch the application to use the given database.
+        """
+        raise QError("Not implemented %s: change_db().", self.__class__.__name__)
+
     def db_reset(self):
         """
         Create new empty database.
@@ -20,6 +33,64 @@ class DatabaseMixin:
         info = self.db_info()
         Mysql().create(info)
 
+    def db_snapshot_name(self, digest):
+        """
+        Get the name of the snapshot database for the dump having the content hash.
+        """
+        return self._db_snapshot_format().replace('%s', digest[0:16])
+
+    def _db_snapshot_format(self):
+        """
+        Get the snapshot name format with the application name filled in.
+        """
+        app = re.sub('[^a-z0-9]+', '_', str(self.settings.APP or '').lower()).strip('_')
+        return self.settings.DB_SNAPSHOT_NAME.replace('%a', app)
+
+    def db_snapshot(self, info, path):
+        """
+        Keep a copy of the database as the pristine state of the dump it was loaded from.
+        """
+        from q import Q
+        snapshot = self.db_snapshot_name(QBlobs.digest(path))
+        if not Mysql().clone(info, snapshot):
+            Q.wr('Database', "Database '%s' has views, triggers or routines, so not keeping a snapshot.", info['db'])
+
+    def db_restore(self, info, path):
+        """
+        Recreate the database from the snapshot of the dump, if there is one. Returns True on success.
+        """
+        snapshot = self.db_snapshot_name(QBlobs.digest(path))
+        if snapshot not in Mysql().databases(info, snapshot):
+            return False
+        source = dict(info)
+        source['db'] = snapshot
+        return Mysql().clone(source, info['db'])
+
+    def db_snapshots(self):
+        """
+        List the names of the snapshot databases of this application.
+        """
+        template = self._db_snapshot_format()
+        pattern = template.replace('_', '\\_').replace('%s', '%')
+        # The pattern matches also longer application names, so check the hash part exactly.
+        exact = re.compile('^' + re.escape(template).replace(re.escape('%s'), '[0-9a-f]{16}') + '$')
+        return [name for name in Mysql().databases(self.db_info(), pattern) if exact.match(name)]
+
+    def db_drop_snapshots(self, digests):
+        """
+        Remove the snapshot databases of dumps not having any of the given content hashes.
+        Returns the number of snapshots removed.
+        """
+        used = set(self.db_snapshot_name(digest) for digest in digests)
+        count = 0
+        for name in self.db_snapshots():
+            if name not in used:
+                info = self.db_info()
+                info['db'] = name
+                Mysql().destroy(info)
+                count += 1
+        return count
+
 
 class DatabaseByDjango(DatabaseMixin):
     """
@@ -1,14 +1,9 @@
-import sys
-import inspect
 import re
 import os
-import random
-import readline
-import glob
-import time
-import shutil
+import stat
 
 from .error import QError
+from .profiling import QProfile
 
 
 class QFile:
@@ -16,6 +11,9 @@ class QFile:
     Simple file format for saving ticket information and settings as key value pairs.
     """
 
+    # Any non-indented line starts a new key. The last character is the colon.
+    KEY_LINE = re.compile(r'^(?=[^ \n])([^\n]*)[^\n]\n?', re.M)
+
     def __init__(self, path = None):
         self.path = path
 
@@ -33,36 +31,77 @@ class QFile:
     def write(self, raw_data):
         """
         Write raw data string to the current path.
+
+        The data goes to a temporary file first, which then replaces the target atomically.
+        Permissions of an existing target are kept and a symbolic link is followed, so that
+        the file it points to is the one replaced.
         """
         if not self.path:
             raise QError("Path not set for saving a file.")
-        f = open(self.path,'w')
-        f.write(raw_data)
-        f.close()
+        path = os.path.realpath(self.path)
+        dir, name = os.path.split(path)
+        tmp = os.path.join(dir, '.' + name + '.tmp')
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            mode = None
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        # Create the file already without access for others, if the target has it so.
+        f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666 if mode is None else mode), 'w')
+        try:
+            f.write(raw_data)
+        finally:
+            f.close()
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.rename(tmp, path)
 
+    @QProfile.timed('QFile.load')
     def load(self):
         """
         Load data from the current path and return as a dictionary.
         """
+        raw, offsets = self.sections()
         ret = {}
-        data = self.read().decode('utf-8')
-        str = None
+        for k in offsets:
+            start, end = offsets[k]
+            ret[k] = QFile.decode(raw[start:end])
+        return ret
+
+    @QProfile.timed('QFile.sections')
+    def sections(self):
+        """
+        Read the raw data and locate the value block of each key without decoding it.
+
+        Returns the raw data and a dictionary mapping keys to (start, end) offsets of their values.
+        """
+        raw = self.read()
+        offsets = {}
         k = None
-        for line in data.split("\n"):
+        start = 0
+        for match in QFile.KEY_LINE.finditer(raw):
+            if k is not None:
+                offsets[k.decode('utf-8')] = (start, match.start())
+            k = match.group(1)
+            start = match.end()
+        if k is not None:
+            offsets[k.decode('utf-8')] = (start, len(raw))
+        return raw, offsets
+
+    @staticmethod
+    def decode(raw):
+        """
+        Convert a raw value block to the value string.
+        """
+        lines = []
+        for line in raw.decode('utf-8').split("\n"):
             if len(line)==0:
                 continue
-            if line[0]!=' ':
-                if k != None:
-                    ret[k] = str.strip()
-                k = line[0:-1]
-                str = ""
-            else:
-                str+=line[2:].rstrip()
-                str+="\n"
-            if k != None:
-                ret[k] = str.strip()
-        return ret
+            lines.append(line[2:].rstrip())
+        return "\n".join(lines).strip()
 
+    @QProfile.timed('QFile.save')
     def save(self, values, order=None):
         """
         Write a file from key value pair dictionary with optional key order.
@@ -70,18 +109,17 @@ class QFile:
         key_list = order
         if not key_list:
             key_list = sorted(values.keys())
-        out = ""
+        out = []
         for k in key_list:
             if not k in values:
                 continue
-            out += k + ":\n"
+            out.append(k + ":\n")
             if not (type(values[k]) is unicode or type(values[k]) is str):
                 lines = unicode(values[k]).split("\n")
             else:
                 lines = values[k].split("\n")
-            for line in lines:
-                out += "  " + line + "\n"
-        self.write(out.encode('utf-8'))
+            out.append("  " + "\n  ".join(lines) + "\n")
+        self.write(u"".join(out).encode('utf-8'))
 
     def drop(self):
         """
@@ -1,20 +1,28 @@
 import sys
-import inspect
 import re
 import os
-import random
-import readline
-import glob
 import time
-import shutil
 import tempfile
-import requests
+import threading
+import shlex
+import subprocess
+import zlib
 
 from .error import QError
 from .file import QFile
+from .connection import QConnection
+from .profiling import QProfile
 from .ticket import Ticket
 
 
+def host(url):
+    """
+    Get the host part of the URL for naming the profiling spans.
+    """
+    parts = url.split('/')
+    return parts[2] if len(parts) > 2 else url
+
+
 class QHelper(object):
     """
     A helper base class.
@@ -65,10 +73,14 @@ class Sed(QHelper):
             data += "\n"
         if found:
             QFile(path).write(data)
+            Git.forget()
 
 
 class Curl(QHelper):
-
+    """
+    HTTP helper returning the response body, using the shared connections.
+    """
+    @QProfile.timed(lambda self, url, *args, **kwargs: 'Curl ' + host(url))
     def run(self, url, post=None, put=None, patch=None, upload=None, quiet=False, user=None, password=None, content_type=None):
         """
         Make a HTTP-request and return the results.
@@ -77,56 +89,42 @@ class Curl(QHelper):
         if self.settings.OFFLINE_MODE == 'yes':
             self.wr("Skipping in offline-mode: "+Q.URL + url + Q.END)
             return ''
-        import pycurl
-        import cStringIO
-        import urllib
-        buf = cStringIO.StringIO()
-        c = pycurl.Curl(self.settings)
-        c.setopt(c.URL, url)
-        c.setopt(c.WRITEFUNCTION, buf.write)
         method = 'GET'
+        kwargs = {}
         if post:
             method = 'POST'
-            c.setopt(c.POSTFIELDS, urllib.urlencode(post))
+            kwargs['data'] = post
         if put:
             method = 'PUT'
-            c.setopt(c.CUSTOMREQUEST, "PUT")
-            c.setopt(c.POSTFIELDS, urllib.urlencode(put))
+            kwargs['data'] = put
         if patch:
             method = 'PATCH'
-            c.setopt(c.CUSTOMREQUEST, "PATCH")
-            c.setopt(c.POSTFIELDS, patch)
+            kwargs['data'] = patch
+        files = {}
         if upload:
             method = 'POST'
-            values = []
             for path in upload.keys():
-                values.append((path, (pycurl.FORM_FILE, upload[path])))
-            c.setopt(c.HTTPPOST, values)
+                files[path] = open(upload[path], 'rb')
+            kwargs['files'] = files
         if content_type:
-            c.setopt(pycurl.HTTPHEADER, ["Content-Type: %s" % content_type])
+            kwargs['headers'] = {'Content-Type': content_type}
+        if user:
+            kwargs['auth'] = (user, password or '')
         if not quiet:
             self.wr("Calling: "+method +" " +Q.URL + url + Q.END)
-        if os.environ.get('http_proxy'):
-            c.setopt(c.PROXY, os.environ.get('http_proxy'))
-        if user:
-            c.setopt(c.USERNAME, user)
-        if password:
-            c.setopt(c.PASSWORD, password)
-        c.setopt(c.FOLLOWLOCATION, True)
-#        c.setopt(c.VERBOSE, True)
         try:
-            c.perform()
-        except pycurl.error, e:
-            raise QError('Curl call to %r failed: %r', url, e)
-        ret = buf.getvalue()
-        buf.close()
-        return ret
+            resp = QConnection(self.settings).request(method, url, **kwargs)
+        finally:
+            for f in files.values():
+                f.close()
+        return resp.content
 
 
 class Requests(QHelper):
     """
-    Newer HTTP helper version using `requests`.
+    Newer HTTP helper version using `requests` through the shared connections.
     """
+    @QProfile.timed(lambda self, url, *args, **kwargs: 'Requests ' + host(url))
     def run(self, url, get=None, post=None, put=None, delete=None, patch=None, upload=None, quiet=False, user=None, password=None, auth=None):
         from q import Q
         if self.settings.OFFLINE_MODE == 'yes':
@@ -134,35 +132,202 @@ class Requests(QHelper):
             return None
         if user:
             auth = (user, password)
-        method = requests.get
+        method = 'GET'
         json = None
         params = None
         if post:
-            method = requests.post
+            method = 'POST'
             json = post
         elif put:
-            method = requests.put
+            method = 'PUT'
             json = put
         elif patch:
-            method = requests.patch
+            method = 'PATCH'
             json = patch
         elif get:
-            method = requests.get
+            method = 'GET'
             params = get
         elif delete:
-            method = requests.delete
-        return method(url, auth=auth, json=json, params=params)
+            method = 'DELETE'
+        return QConnection(self.settings).request(method, url, auth=auth, json=json, params=params)
+
+
+class Parallel(QHelper):
+    """
+    Run a function for each item concurrently using a bounded pool of threads.
+    """
+    def run(self, fn, items, threads=None, rate=None, errors=False):
+        """
+        Call the function for every item and return the results in the same order.
+        The first failure is re-raised after all calls have finished, unless `errors` is set,
+        when the exception of each failed call is returned in its place.
+        If the rate is given, at most that many calls are started per second.
+        """
+        items = list(items)
+        if rate:
+            limited = fn
+            lock = threading.Lock()
+            schedule = [time.time()]
+
+            def fn(item):
+                with lock:
+                    wait = schedule[0] - time.time()
+                    schedule[0] = max(schedule[0], time.time()) + 1.0 / rate
+                if wait > 0:
+                    time.sleep(wait)
+                return limited(item)
+        if threads is None:
+            threads = int(self.settings.PARALLEL_THREADS) if self.settings else 1
+        threads = min(threads, len(items))
+
+        def call(item):
+            # Catch everything, since QError is not an Exception and would kill the worker.
+            try:
+                return (True, fn(item))
+            except BaseException:
+                return (False, sys.exc_info())
+
+        if threads <= 1:
+            if not errors:
+                return [fn(item) for item in items]
+            results = [call(item) for item in items]
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(threads)
+            try:
+                results = pool.map(call, items)
+            finally:
+                pool.close()
+                pool.join()
+        for ok, value in results:
+            if not ok and (not errors or issubclass(value[0], (KeyboardInterrupt, SystemExit))):
+                raise value[0], value[1], value[2]
+        if errors:
+            return [value if ok else value[1] for ok, value in results]
+        return [value for ok, value in results]
+
+
+class GzipStream(object):
+    """
+    A writable file wrapper compressing to or decompressing from gzip format on the fly.
+    """
+    def __init__(self, output, decompress=False, level=6):
+        self.output = output
+        self.decompress = decompress
+        if decompress:
+            self.codec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.codec = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        if not self.decompress:
+            self.output.write(self.codec.compress(data))
+            return
+        while data:
+            self.output.write(self.codec.decompress(data))
+            data = self.codec.unused_data
+            if data.strip('\0') == '':
+                break
+            # Next member of a concatenated file.
+            self.codec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def close(self):
+        """
+        Write out the rest of the data. The wrapped file is not closed.
+        """
+        self.output.write(self.codec.flush())
+
+
+class Stream(QHelper):
+    """
+    Copy data in chunks from a file to one or more files while reporting the progress.
+    """
+    # Size of the chunks read at once.
+    CHUNK = 1024 * 1024
+
+    def run(self, input, outputs, total=None, label='Copying'):
+        """
+        Copy everything from the input to the outputs and return the number of bytes copied.
+        If the total size of the input is known, the progress is shown as a percentage.
+        """
+        done = 0
+        started = time.time()
+        shown = started
+        tty = sys.stderr.isatty()
+        while True:
+            data = input.read(Stream.CHUNK)
+            if not data:
+                break
+            for output in outputs:
+                output.write(data)
+            done += len(data)
+            if tty and time.time() - shown > 0.5:
+                shown = time.time()
+                self.progress(label, done, total, shown - started)
+        for output in outputs:
+            if isinstance(output, GzipStream):
+                output.close()
+        if tty:
+            self.progress(label, done, total, time.time() - started)
+            sys.stderr.write("\n")
+        return done
+
+    def progress(self, label, done, total, elapsed):
+        """
+        Show the status of copying on the current line of the terminal.
+        """
+        line = '%s: %.1f MB' % (label, done / 1048576.0)
+        if total:
+            line += ' / %.1f MB (%d%%)' % (total / 1048576.0, 100 * done / total)
+        if elapsed > 0:
+            line += ' %.1f MB/s' % (done / 1048576.0 / elapsed)
+        sys.stderr.write("\r" + line + "\033[K")
+        sys.stderr.flush()
 
 
 class SystemCall(QHelper):
     """
     Interface for running specific system commands.
+
+    Simple commands are executed directly as an argument vector and only commands using
+    shell features like redirections, pipes or variables are passed to the shell.
     """
     command = None
 
+    # Characters or constructs needing the shell, when found outside of the quotes.
+    SHELL_SYNTAX = re.compile(r'[|&;<>()$`*?\[\]{}~#]|^\s*\w+=')
+    # Quoted parts of the command line.
+    QUOTED = re.compile(r"'[^']*'|\"((?:\\.|[^\"\\])*)\"")
+
     def __call__(self, *args, **kwargs):
         return self.run(*args, **kwargs)
 
+    def label(self, *args, **kwargs):
+        """
+        Name the profiling span by the command and its first argument.
+        """
+        words = ' '.join(str(arg) for arg in args).split()
+        return (kwargs.get('command') or self.command or '') + (' ' + words[0] if words else '')
+
+    def argv(self, cmd):
+        """
+        Split the command line to an argument vector or return None if the shell is needed.
+        """
+        for match in SystemCall.QUOTED.finditer(cmd):
+            inner = match.group(1)
+            if inner is not None and re.search(r'[$`]', inner):
+                return None
+        if SystemCall.SHELL_SYNTAX.search(SystemCall.QUOTED.sub('', cmd)):
+            return None
+        try:
+            argv = shlex.split(cmd)
+        except ValueError:
+            return None
+        if not argv:
+            return None
+        return argv
+
+    @QProfile.timed(label)
     def run(self, *args, **kwargs):
         """
         Run the command.
@@ -178,23 +343,37 @@ class SystemCall(QHelper):
         if not command_name:
             command_name = self.command
         cmd = command_name + " " + " ".join(args)
-        outfile = None
-        if kwargs.get('get_output',False):
-            outfile = "/tmp/output-"+os.environ['USER']+"-"+str(random.random())
-            cmd += " > "+outfile
-        if kwargs.get('stderr',False):
-            cmd += " 2>&1"
-        chdir = kwargs.get('chdir',False)
-        if chdir:
-            cmd = "cd "+chdir+"; "+cmd
+        if not self.is_query(command_name, args):
+            Git.forget()
+        get_output = kwargs.get('get_output', False)
+        chdir = kwargs.get('chdir', False)
         if not kwargs.get('no_echo',False):
-            self.wr(Q.COMMAND+cmd+Q.END)
-        ret = None
-        ret = os.system(cmd)
-        if outfile:
-            ret = QFile(outfile).read()
-            os.remove(outfile)
-        return ret
+            if chdir:
+                self.wr(Q.COMMAND+"cd "+chdir+"; "+cmd+Q.END)
+            else:
+                self.wr(Q.COMMAND+cmd+Q.END)
+        argv = self.argv(cmd)
+        try:
+            process = subprocess.Popen(argv or cmd,
+                                       shell=argv is None,
+                                       cwd=chdir or None,
+                                       stdout=subprocess.PIPE if get_output else None,
+                                       stderr=subprocess.STDOUT if kwargs.get('stderr', False) else None)
+        except OSError as e:
+            self.wr(Q.ERROR + "Cannot run '%s': %s" + Q.END, cmd, e.strerror)
+            if get_output:
+                return ''
+            return 127
+        out = process.communicate()[0]
+        if get_output:
+            return out
+        return process.returncode
+
+    def is_query(self, command_name, args):
+        """
+        Check if the command only reads and does not change any files.
+        """
+        return False
 
 
 class Mysql(SystemCall):
@@ -220,21 +399,77 @@ class Mysql(SystemCall):
         cmd += ' ' + dbinfo['db']
         return self.run(cmd)
 
-    def save(self, dbinfo, path):
+    def _argv(self, dbinfo):
         """
-        Create dump of the database to the given file.
+        Construct argument vector of connection options for the given database.
         """
-        cmd = self._cmd(dbinfo)
-        cmd += ' ' + dbinfo['db'] + ' > '+ path
-        return self.run(cmd, command='mysqldump')
+        return shlex.split(self._cmd(dbinfo))
 
-    def load(self, dbinfo, path):
+    def save(self, dbinfo, path):
         """
-        Load a dump of the database from the given file.
+        Create dump of the database to the given file, compressing it if the name ends with `.gz`.
         """
-        cmd = self._cmd(dbinfo)
-        cmd += ' '+dbinfo['db'] + ' < '+ path
-        return self.run(cmd, command='mysql')
+        from q import Q
+        argv = ['mysqldump'] + self._argv(dbinfo) + [dbinfo['db']]
+        self.wr(Q.COMMAND + 'mysqldump ' + self._cmd(dbinfo) + ' ' + dbinfo['db'] + ' > ' + path + Q.END)
+        tmp = path + '.tmp'
+        try:
+            process = subprocess.Popen(argv, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise QError("Cannot run mysqldump: %s.", e.strerror)
+        try:
+            with open(tmp, 'wb') as output:
+                Stream()(process.stdout, [GzipStream(output) if path.endswith('.gz') else output], label='Dumping')
+        except IOError as e:
+            process.kill()
+            raise QError("Cannot write dump '%s': %s.", path, e.strerror)
+        finally:
+            process.stdout.close()
+            if process.wait() != 0 and os.path.exists(tmp):
+                os.unlink(tmp)
+        if process.returncode != 0:
+            raise QError("Dumping database '%s' failed.", dbinfo['db'])
+        os.rename(tmp, path)
+        return 0
+
+    def load(self, dbinfo, path, keep=None):
+        """
+        Load a dump of the database from the given file, uncompressing it if the name ends with `.gz`.
+        If `keep` is given, a compressed copy of the dump is stored there while loading.
+        """
+        from q import Q
+        argv = ['mysql'] + self._argv(dbinfo) + [dbinfo['db']]
+        self.wr(Q.COMMAND + 'mysql ' + self._cmd(dbinfo) + ' ' + dbinfo['db'] + ' < ' + path + Q.END)
+        compressed = path.endswith('.gz')
+        try:
+            process = subprocess.Popen(argv, stdin=subprocess.PIPE)
+        except OSError as e:
+            raise QError("Cannot run mysql: %s.", e.strerror)
+        copy = None
+        try:
+            with open(path, 'rb') as input:
+                outputs = [GzipStream(process.stdin, decompress=True) if compressed else process.stdin]
+                if keep:
+                    copy = open(keep + '.tmp', 'wb')
+                    outputs.append(copy if compressed else GzipStream(copy))
+                Stream()(input, outputs, total=os.fstat(input.fileno()).st_size, label='Loading')
+            process.stdin.close()
+        except (IOError, zlib.error) as e:
+            process.kill()
+            process.wait()
+            if copy:
+                copy.close()
+                os.unlink(keep + '.tmp')
+            raise QError("Loading dump '%s' failed: %s.", path, e)
+        if copy:
+            copy.close()
+        if process.wait() != 0:
+            if copy:
+                os.unlink(keep + '.tmp')
+            raise QError("Loading dump '%s' failed.", path)
+        if copy:
+            os.rename(keep + '.tmp', keep)
+        return 0
 
     def exists(self, dbinfo):
         """
@@ -263,20 +498,174 @@ class Mysql(SystemCall):
         cmd += ' create '+dbinfo['db']
         return self.run(cmd, command='mysqladmin')
 
+    # Escapes used by the mysql client in batch mode.
+    UNESCAPE = {'n': '\n', 't': '\t', '0': '\0', '\\': '\\'}
+
+    def query(self, dbinfo, sql):
+        """
+        Run SQL statements on the database and return the result rows as lists of column values.
+        """
+        argv = ['mysql'] + self._argv(dbinfo) + ['--batch', '--skip-column-names']
+        if dbinfo['db']:
+            argv.append(dbinfo['db'])
+        try:
+            process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise QError("Cannot run mysql: %s.", e.strerror)
+        out = process.communicate(sql)[0]
+        if process.returncode != 0:
+            raise QError("Query on database '%s' failed.", dbinfo['db'])
+        unescape = lambda match: Mysql.UNESCAPE.get(match.group(1), match.group(1))
+        return [[re.sub(r'\\(.)', unescape, col) for col in line.split('\t')] for line in out.split('\n') if line]
+
+    def clone(self, dbinfo, target):
+        """
+        Copy the database to the target database inside the server, replacing the target.
+
+        Tables are created with their original definitions and filled with bulk inserts, so that
+        no SQL text is replayed. Returns False if the database has views, triggers or routines,
+        which are not copied.
+        """
+        db = dbinfo['db']
+        counts = self.query(dbinfo, """
+            SELECT (SELECT COUNT(*) FROM information_schema.VIEWS WHERE TABLE_SCHEMA = DATABASE()),
+                   (SELECT COUNT(*) FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE()),
+                   (SELECT COUNT(*) FROM information_schema.ROUTINES WHERE ROUTINE_SCHEMA = DATABASE());
+        """)
+        if counts[0] != ['0', '0', '0']:
+            return False
+        tables = [row[0] for row in self.query(dbinfo, "SHOW FULL TABLES WHERE Table_type = 'BASE TABLE';")]
+        creates = []
+        if tables:
+            creates = self.query(dbinfo, ''.join(['SHOW CREATE TABLE `%s`;' % table for table in tables]))
+        sql = ["SET FOREIGN_KEY_CHECKS = 0;", "SET UNIQUE_CHECKS = 0;", "SET SESSION sql_mode = 'NO_AUTO_VALUE_ON_ZERO';"]
+        for table, create in creates:
+            sql.append(create + ';')
+            sql.append('INSERT INTO `%s` SELECT * FROM `%s`.`%s`;' % (table, db, table))
+        info = dict(dbinfo)
+        info['db'] = target
+        self.create(info)
+        self.wr("Copying %d tables from '%s' to '%s'.", len(creates), db, target)
+        self.query(info, '\n'.join(sql))
+        return True
+
+    def databases(self, dbinfo, pattern):
+        """
+        List the names of the databases matching the SQL LIKE pattern.
+        """
+        info = dict(dbinfo)
+        info['db'] = ''
+        return [row[0] for row in self.query(info, "SHOW DATABASES LIKE '%s';" % pattern)]
+
 
 class Git(SystemCall):
     """
     Interface to GIT operations.
+
+    Results of the read-only queries are memoized for the current repository state
+    until any command possibly changing the repository or the working tree is run.
     """
 
     command = 'git'
     user = None
 
+    # Memoized query results by repository state and query.
+    queries = {}
+    # Git directories found for working directories.
+    git_dirs = {}
+    # Sub-commands not changing the repository nor the working tree.
+    READ_ONLY = ['status', 'log', 'show', 'diff', 'rev-parse', 'merge-base', 'ls-files', 'remote -v', 'stash list', '--no-pager diff']
+
+    @staticmethod
+    def forget():
+        """
+        Drop all memoized query results.
+        """
+        Git.queries = {}
+
+    def is_query(self, command_name, args):
+        if command_name != 'git':
+            return False
+        cmd = ' '.join(args).strip() + ' '
+        for prefix in Git.READ_ONLY:
+            if cmd.startswith(prefix + ' ') and not re.search(r'[^-]>', cmd):
+                return True
+        return False
+
+    def git_dir(self):
+        """
+        Find the git directory of the current working directory or None.
+        """
+        cwd = os.getcwd()
+        if cwd not in Git.git_dirs:
+            path = cwd
+            found = None
+            while True:
+                candidate = os.path.join(path, '.git')
+                if os.path.isdir(candidate):
+                    found = candidate
+                elif os.path.isfile(candidate):
+                    link = open(candidate).read().strip()
+                    if link.startswith('gitdir:'):
+                        found = os.path.join(path, link[7:].strip())
+                if found or os.path.dirname(path) == path:
+                    break
+                path = os.path.dirname(path)
+            Git.git_dirs[cwd] = found
+        return Git.git_dirs[cwd]
+
+    def state(self):
+        """
+        Construct a key describing the current repository state or None if not known.
+        """
+        git_dir = self.git_dir()
+        if git_dir is None:
+            return None
+        try:
+            head = open(os.path.join(git_dir, 'HEAD')).read()
+        except IOError:
+            return None
+        stamps = []
+        for name in ['index', 'refs/stash']:
+            try:
+                stamps.append(os.stat(os.path.join(git_dir, name)).st_mtime)
+            except OSError:
+                stamps.append(None)
+        return (git_dir, head) + tuple(stamps)
+
+    def memo(self, query, fn):
+        """
+        Get the memoized result of the query or compute it using the function.
+        """
+        state = self.state()
+        if state is None:
+            return fn()
+        key = (state, query)
+        if key in Git.queries:
+            QProfile.count('Git memo hits')
+            return Git.queries[key]
+        QProfile.count('Git memo misses')
+        ret = fn()
+        Git.queries[key] = ret
+        return ret
+
+    def status(self):
+        """
+        Get the output of the status command.
+        """
+        return self.memo('status', lambda : self.run('status', get_output=True, no_echo=True, stderr=True))
+
+    def stash_list(self):
+        """
+        Get the output of the stash listing.
+        """
+        return self.memo('stash list', lambda : self.run('stash list', get_output=True, no_echo=True))
+
     def current_branch_name(self, ignore_error=False):
         """
         Resolve the name of the current branch.
         """
-        for line in self.run('status', get_output=True, no_echo=True, stderr=True).split("\n"):
+        for line in self.status().split("\n"):
             name = re.search(r'On branch (.+)', line)
             if name:
                 return name.group(1)
@@ -285,7 +674,7 @@ class Git(SystemCall):
         raise QError("Not currently on the git working directory or not on any specific branch.")
 
     def branch_exists(self, name):
-        text = self.run('rev-parse --verify ' + name, get_output=True, stderr=True)
+        text = self.memo('rev-parse --verify ' + name, lambda : self.run('rev-parse --verify ' + name, get_output=True, stderr=True))
         if re.match('^[0-9a-f]+$', text.strip()):
             return True
         return False
@@ -297,7 +686,8 @@ class Git(SystemCall):
         args='-1'
         if branch:
             args += ' '+branch
-        for line in self.run('log '+args, get_output=True, no_echo=True).split("\n"):
+        out = self.memo('log ' + args, lambda : self.run('log '+args, get_output=True, no_echo=True))
+        for line in out.split("\n"):
             hit = re.search(r'^commit\s+(.+)', line)
             if hit:
                 return hit.group(1)
@@ -306,10 +696,8 @@ class Git(SystemCall):
         """
         Find the commit code of the latest commit in develop branch.
         """
-        develop = self.latest_commit(self.settings.BASE_BRANCH)
-        this = self.latest_commit()
-        commit = self.run('merge-base '+this+' '+develop, get_output=True)
-        return commit.strip()
+        query = 'merge-base HEAD ' + self.settings.BASE_BRANCH
+        return self.memo(query, lambda : self.run(query, get_output=True)).strip()
 
     def username(self):
         """
@@ -331,7 +719,7 @@ class Git(SystemCall):
         Verify if there are any changes to commit.
         """
         ret = True
-        for line in self.run('status',get_output=True, no_echo=False).split("\n"):
+        for line in self.status().split("\n"):
             if re.search(r'nothing to commit.*working (tree|directory) clean', line):
                 ret = False
                 break
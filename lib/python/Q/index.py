@@ -0,0 +1,79 @@
+import os
+
+from .file import QFile
+from .store import QStore
+
+
+class QIndex:
+    """
+    Persistent index of the ticket header fields stored in the WORKDIR.
+    """
+
+    # Fields of the ticket README kept in the index.
+    KEYS = ['Title', 'Status', 'Base', 'Branch', 'Owner', 'Started', 'Finished', 'Epic']
+    # Version of the stored index, changed when its content changes.
+    VERSION = 2
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.index = None
+        self.changed = False
+
+    def path(self):
+        return os.path.join(self.settings.WORKDIR, '.q.index')
+
+    def load(self):
+        """
+        Read the index from the disk or start an empty one, if not valid.
+        """
+        self.index = QStore(self.path(), QIndex.VERSION).load()
+        if self.index is None:
+            self.index = {}
+            self.changed = True
+
+    def save(self):
+        """
+        Write the index to the disk.
+        """
+        QStore(self.path(), QIndex.VERSION).write(self.index)
+        self.changed = False
+
+    def refresh(self, codes):
+        """
+        Bring the index up to date for the given ticket codes by re-parsing only changed READMEs.
+        """
+        if self.index is None:
+            self.load()
+        seen = set()
+        for code in codes:
+            seen.add(code)
+            path = os.path.join(self.settings.WORKDIR, code, 'README')
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamp = (st.st_mtime, st.st_size)
+            entry = self.index.get(code)
+            if entry is None or entry['stamp'] != stamp:
+                data = QFile(path).load()
+                fields = {}
+                for k in QIndex.KEYS:
+                    if k in data:
+                        fields[k] = data[k]
+                self.index[code] = {'stamp': stamp, 'fields': fields}
+                self.changed = True
+        for code in list(self.index.keys()):
+            if code not in seen:
+                del self.index[code]
+                self.changed = True
+        if self.changed:
+            self.save()
+
+    def fields(self, code):
+        """
+        Get the indexed fields of the ticket as a dictionary or None if not indexed.
+        """
+        entry = self.index.get(code)
+        if entry is None:
+            return None
+        return entry['fields']
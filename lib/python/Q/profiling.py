@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import threading
+import functools
+
+
+class QProfile:
+    """
+    Timing of the hot paths collected as a tree of nested spans.
+
+    Calls of the same name under the same parent are merged into one node counting the calls and
+    their total wall time. Spans started in worker threads are placed under the root. When a trace
+    file is requested, each call is also recorded as an event in Chrome trace format.
+    """
+
+    # Set when collecting.
+    enabled = False
+    # Top of the tree as a node.
+    root = None
+    # Path of the JSON trace file to write or None for printing the tree.
+    trace = None
+    # Recorded calls for the trace file.
+    events = []
+    # Counts of events without timing by name.
+    counters = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    @staticmethod
+    def node(name):
+        return {'name': name, 'count': 0, 'time': 0.0, 'children': {}, 'order': []}
+
+    @staticmethod
+    def setup(argv):
+        """
+        Turn collecting on, if requested by `--profile[=<file.json>]` option or Q_PROFILE variable.
+        Returns the arguments without the option.
+        """
+        value = os.environ.get('Q_PROFILE')
+        ret = []
+        for arg in argv:
+            if arg == '--profile':
+                value = '1'
+            elif arg.startswith('--profile='):
+                value = arg[10:]
+            else:
+                ret.append(arg)
+        if value and value != '0':
+            QProfile.enabled = True
+            QProfile.root = QProfile.node('q ' + ' '.join(ret))
+            QProfile.root['start'] = time.time()
+            QProfile.events = []
+            QProfile.counters = {}
+            QProfile.local.stack = [QProfile.root]
+            QProfile.trace = value if value.endswith('.json') else None
+        return ret
+
+    @staticmethod
+    def finish():
+        """
+        Print the tree or write the trace file, if collecting.
+        """
+        if not QProfile.enabled:
+            return
+        QProfile.enabled = False
+        root = QProfile.root
+        root['count'] = 1
+        root['time'] = time.time() - root['start']
+        if QProfile.trace:
+            import json
+            with open(QProfile.trace, 'w') as output:
+                json.dump({'traceEvents': QProfile.events, 'displayTimeUnit': 'ms',
+                           'otherData': QProfile.counters}, output)
+            sys.stderr.write("Profile trace written to %s.\n" % QProfile.trace)
+        else:
+            QProfile.show(root, 0, root['time'])
+            for name in sorted(QProfile.counters):
+                sys.stderr.write("%19s %6d  %s\n" % ('', QProfile.counters[name], name))
+
+    @staticmethod
+    def show(node, depth, total):
+        """
+        Print the node and its children as a tree with the slowest first.
+        """
+        sys.stderr.write("%9.1f ms %5.1f%% %6d  %s%s\n" % (node['time'] * 1000, 100 * node['time'] / (total or 1),
+                                                        node['count'], '  ' * depth, node['name']))
+        children = [node['children'][name] for name in node['order']]
+        if children:
+            # Time spent outside of the recorded calls.
+            own = QProfile.node('(self)')
+            own['count'] = node['count']
+            own['time'] = max(node['time'] - sum(child['time'] for child in children), 0.0)
+            children.append(own)
+        for child in sorted(children, key=lambda child: -child['time']):
+            QProfile.show(child, depth + 1, total)
+
+    @staticmethod
+    def count(name):
+        """
+        Increment the named counter, if collecting.
+        """
+        if not QProfile.enabled:
+            return
+        with QProfile.lock:
+            QProfile.counters[name] = QProfile.counters.get(name, 0) + 1
+
+    @staticmethod
+    def begin(name):
+        stack = getattr(QProfile.local, 'stack', None)
+        if stack is None:
+            stack = QProfile.local.stack = [QProfile.root]
+        with QProfile.lock:
+            parent = stack[-1]
+            if name not in parent['children']:
+                parent['children'][name] = QProfile.node(name)
+                parent['order'].append(name)
+            node = parent['children'][name]
+        stack.append(node)
+        return node
+
+    @staticmethod
+    def end(node, started):
+        elapsed = time.time() - started
+        QProfile.local.stack.pop()
+        with QProfile.lock:
+            node['count'] += 1
+            node['time'] += elapsed
+            if QProfile.trace:
+                QProfile.events.append({'name': node['name'], 'ph': 'X', 'pid': os.getpid(),
+                                        'tid': threading.current_thread().ident,
+                                        'ts': int((started - QProfile.root['start']) * 1e6),
+                                        'dur': int(elapsed * 1e6)})
+
+    @staticmethod
+    def timed(label):
+        """
+        Decorator recording the calls of the function. The label is the name of the span or
+        a function computing it from the arguments of the call.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not QProfile.enabled:
+                    return fn(*args, **kwargs)
+                node = QProfile.begin(label(*args, **kwargs) if callable(label) else label)
+                started = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    QProfile.end(node, started)
+            return wrapper
+        return decorator
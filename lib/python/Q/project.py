@@ -2,31 +2,64 @@ import sys
 import os
 import re
 import glob
-from distutils.dir_util import mkpath
+import types
+import importlib
 
 from .error import QError
-from .building import NoBuild, BuildByBamboo, BuildByCommandLine
-from .reviewing import ReviewByReviewBoard, ReviewByGerrit, ReviewByVSTS, ReviewByBitbucket, NoReview, ReviewByLocalDiff
-from .testing import TestingByNose, TestingByShellCommands
-from .database import DatabaseByDjango
-from .ticketing import TicketingByTrac, ManualTicketing, TicketingByVSTS, TicketingByAtlassian
-from .releasing import NoReleasing, ReleasingByGerrit, ReleasingByBamboo, ReleasingByMerge
-from .timing import NoTiming, TimingByAtlassian
 from .command import Command
 from .ticket import Ticket
+from .index import QIndex
 
 
 class QProject:
     """
     Base functionality for querying and executing tasks for the application project.
     """
+
+    # Modules implementing each mixin available for APP_* settings.
+    mixins = {
+              'NoBuild': 'building',
+              'BuildByBamboo': 'building',
+              'BuildByCommandLine': 'building',
+              'NoReview': 'reviewing',
+              'ReviewByLocalDiff': 'reviewing',
+              'ReviewByReviewBoard': 'reviewing',
+              'ReviewByGerrit': 'reviewing',
+              'ReviewByVSTS': 'reviewing',
+              'ReviewByBitbucket': 'reviewing',
+              'TestingByShellCommands': 'testing',
+              'TestingByNose': 'testing',
+              'DatabaseByDjango': 'database',
+              'ManualTicketing': 'ticketing',
+              'TicketingByTrac': 'ticketing',
+              'TicketingByVSTS': 'ticketing',
+              'TicketingByAtlassian': 'ticketing',
+              'NoReleasing': 'releasing',
+              'ReleasingByGerrit': 'releasing',
+              'ReleasingByBamboo': 'releasing',
+              'ReleasingByMerge': 'releasing',
+              'NoTiming': 'timing',
+              'TimingByAtlassian': 'timing',
+              }
+
+    # Composed project classes by settings file and mixin names.
+    classes = {}
+    # Content of `.q.project.py` as generated by earlier versions from the APP_* settings.
+    generated = """#
+# Automatically generated from `.q`.
+# Just delete this if you want to regenerate it.
+#
+class Project(QProject, APP_TICKETING, APP_RELEASING, APP_REVIEWING, APP_BUILDING, APP_TESTING, APP_TIMING):
+    pass
+"""
+
     def __init__(self, settings, q):
         self.settings = settings
         self.q = q
 
     def __repr__(self):
         if self.settings.APPSETTINGS:
-            return '<Q.Project ' + self.settings.APPSETTINGS + '.project.py>'
+            return '<Q.Project ' + self.settings.APPSETTINGS + '>'
         return '<Q.Project>'
 
     def parse(self, *_argv):
@@ -69,7 +102,7 @@ class QProject:
             raise QError("Ticket storage directory WORKDIR is not set.")
         if not os.path.isdir(self.settings.WORKDIR):
             Q.wr("Initialize", "Creating ticket directory '%s'.", self.settings.WORKDIR)
-            mkpath(self.settings.WORKDIR)
+            os.makedirs(self.settings.WORKDIR)
         ret = []
         for p in os.listdir(self.settings.WORKDIR):
             if os.path.isfile(self.settings.WORKDIR+"/"+p+"/README"):
@@ -98,10 +131,21 @@ class QProject:
     def all_tickets(self):
         """
         Collect a list of all tickets of this project.
+
+        Only the indexed header fields are parsed up front and the rest is loaded on demand.
         """
+        codes = self.all_codes()
+        index = QIndex(self.settings)
+        index.refresh(codes)
         ret = []
-        for code in self.all_codes():
-            ret.append(self.load_ticket(code))
+        for code in codes:
+            fields = index.fields(code)
+            if fields is None:
+                ret.append(self.load_ticket(code))
+            else:
+                ticket = Ticket(self, code)
+                ticket.load_fields(fields)
+                ret.append(ticket)
         return ret
 
     def Q(self, *args):
@@ -110,32 +154,73 @@ class QProject:
         """
         self.q.parse(*args)
 
-    @classmethod
-    def create(cls, settings, q):
-        project_path = os.path.dirname(settings.APPSETTINGS) + '/.q.project.py'
-        if not os.path.exists(project_path) or os.path.getmtime(project_path) < os.path.getmtime(settings.APPSETTINGS):
-            if not settings.APP_TICKETING:
-                raise QError("Ticketing mixing APP_TICKETING must be set in configuration.")
-            definition = """#
-# Automatically generated from `.q`.
-# Just delete this if you want to regenerate it.
-#
-class Project(QProject, APP_TICKETING, APP_RELEASING, APP_REVIEWING, APP_BUILDING, APP_TESTING, APP_TIMING):
-    pass
-"""
-            definition = definition.replace('APP_TICKETING', settings.APP_TICKETING)
-            definition = definition.replace('APP_RELEASING', settings.APP_RELEASING)
-            definition = definition.replace('APP_REVIEWING', settings.APP_REVIEWING)
-            definition = definition.replace('APP_BUILDING', settings.APP_BUILDING)
-            definition = definition.replace('APP_TESTING', settings.APP_TESTING)
-            definition = definition.replace('APP_TIMING', settings.APP_TIMING)
-            f = open(project_path,'w')
-            f.write(definition)
-            f.close()
-        content = {}
+    @staticmethod
+    def mixin(name):
+        """
+        Import the module of the named mixin and return the class.
+        """
+        if name not in QProject.mixins:
+            raise QError("Invalid configuration: unknown mixin %r.", name)
+        package = __name__.rpartition('.')[0]
+        module = importlib.import_module(package + '.' + QProject.mixins[name])
+        return getattr(module, name)
+
+    @staticmethod
+    def custom(settings):
+        """
+        Get the project class from a hand-edited `.q.project.py` next to the settings or None.
+
+        The file used to be generated from the settings and edited for adding mixins. It is
+        still used, if it is newer than the settings and differs from the generated content.
+        """
+        if not settings.APPSETTINGS:
+            return None
+        path = os.path.dirname(settings.APPSETTINGS) + '/.q.project.py'
         try:
-            exec(open(project_path).read(), globals())
+            mtime = os.path.getmtime(path)
+            if mtime < os.path.getmtime(settings.APPSETTINGS):
+                return None
+            key = (path, mtime)
+            if key in QProject.classes:
+                return QProject.classes[key]
+            with open(path) as input:
+                source = input.read()
+        except (IOError, OSError):
+            return None
+        generated = QProject.generated
+        for name in ('APP_TICKETING', 'APP_RELEASING', 'APP_REVIEWING', 'APP_BUILDING', 'APP_TESTING', 'APP_TIMING'):
+            generated = generated.replace(name, str(getattr(settings, name)))
+        if source == generated:
+            return None
+        namespace = {'QProject': QProject}
+        for name in QProject.mixins:
+            namespace[name] = QProject.mixin(name)
+        try:
+            exec(source, namespace)
         except NameError as err:
             raise QError("Invalid configuration: %r.", err)
+        if 'Project' not in namespace:
+            raise QError("Invalid configuration: no class Project in %s.", path)
+        QProject.classes[key] = namespace['Project']
+        return namespace['Project']
 
-        return Project(settings, q)
+    @classmethod
+    def create(cls, settings, q):
+        """
+        Instantiate the project class composed of the mixins named in the settings.
+        """
+        custom = QProject.custom(settings)
+        if custom:
+            return custom(settings, q)
+        if not settings.APP_TICKETING:
+            raise QError("Ticketing mixing APP_TICKETING must be set in configuration.")
+        names = (settings.APP_TICKETING, settings.APP_RELEASING, settings.APP_REVIEWING,
+                 settings.APP_BUILDING, settings.APP_TESTING, settings.APP_TIMING)
+        if settings.APP_DATABASE:
+            names += (settings.APP_DATABASE,)
+        key = (settings.APPSETTINGS, names)
+        if key not in QProject.classes:
+            bases = (QProject,) + tuple(QProject.mixin(name) for name in names)
+            # All bases are classic classes, so the class is made by their metaclass.
+            QProject.classes[key] = types.ClassType('Project', bases, {})
+        return QProject.classes[key](settings, q)
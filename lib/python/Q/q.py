@@ -1,12 +1,6 @@
 import sys
-import inspect
 import re
 import os
-import random
-import readline
-import glob
-import time
-import shutil
 
 from .settings import QSettings
 from .error import QError
@@ -46,14 +40,16 @@ class Q:
     prev_channel = None
     # All loaded projects, the default is the first.
     projects = []
+    # Paths of the linked projects not yet loaded.
+    linked = []
 
     def __init__(self, *argv):
         """
-        Set up the projects.
+        Set up the primary project. Linked projects are loaded when first needed.
         """
         if len(Q.projects):
             raise Exception('Re-running Q' + repr(argv) + ' directly is not permitted anymore.\nPlease use self.Q() instead.')
-        if len(argv) > 0 and argv[0] in ['help', 'settings']:
+        if len(argv) > 0 and argv[0] in ['help', 'settings', 'daemon']:
             Q.projects.append(QProject(QSettings(), self))
         else:
             path = QSettings.find(os.getcwd())
@@ -63,17 +59,33 @@ class Q:
             project = QProject.create(settings, self)
             Q.projects.append(project)
             if settings.LINKED_PROJECTS:
-                for path in settings.LINKED_PROJECTS.split(':'):
-                    path = re.sub('\/$', '', path)
-                    settings = QSettings.load(QSettings.find(path))
-                    project = QProject.create(settings, self)
-                    Q.projects.append(project)
+                Q.linked = [re.sub('\/$', '', path) for path in settings.LINKED_PROJECTS.split(':')]
+
+    def load_project(self, path):
+        """
+        Load the project from the given directory.
+        """
+        settings = QSettings.load(QSettings.find(path))
+        return QProject.create(settings, self)
+
+    def all_projects(self):
+        """
+        Get the list of all projects loading the linked projects concurrently, if not yet loaded.
+        """
+        if Q.linked:
+            from .helper import Parallel
+            paths = Q.linked
+            Q.linked = []
+            Q.projects += Parallel(Q.projects[0].settings)(self.load_project, paths)
+        return Q.projects
 
     def find_project(self, code):
         """
         Find the project handling the given ticket code.
         """
-        for project in self.projects:
+        if re.match(Q.projects[0].settings.TICKET_NUMBER_REGEX, code):
+            return Q.projects[0]
+        for project in self.all_projects():
             if re.match(project.settings.TICKET_NUMBER_REGEX, code):
                 return project
 
@@ -1,10 +1,9 @@
 import os
 import re
 import json
-import simplejson
 
 from .error import QError
-from .helper import Curl, Git, Edit, Requests
+from .helper import Curl, Git, Edit, Requests, Parallel
 
 
 class ReviewMixin:
@@ -42,6 +41,13 @@ class ReviewMixin:
         """
         raise QError("Not implemented in %s: review_status().", self.__class__.__name__)
 
+    def review_status_many(self, review_ids):
+        """
+        Fetch the statuses of several reviews as a list in the same order.
+        A status is an exception or None, if it could not be resolved.
+        """
+        return Parallel(self.settings)(self.review_status, review_ids, errors=True)
+
     def review_update_build(self, ticket):
         """
         Update build information on review.
@@ -94,6 +100,7 @@ class ReviewByLocalDiff(ReviewMixin):
         print
         print "Are the changes acceptable (y/N)?"
         print
+        import readline
         result = raw_input()
         if result == 'y':
             return 'accepted'
@@ -423,7 +430,7 @@ class ReviewByBitbucket(ReviewMixin):
         resp = Requests(self.settings)(url, post=out, auth=self._review_auth())
         try:
             data = resp.json()
-        except simplejson.errors.JSONDecodeError:
+        except ValueError:
             raise QError("Failed to parse response: " + repr(resp))
 
         if data['type'] == 'error':
@@ -453,13 +460,53 @@ class ReviewByBitbucket(ReviewMixin):
         repo = "%s/%s" % (self.settings.BITBUCKET_PROJECT, self.settings.BITBUCKET_REPO)
         return 'https://bitbucket.org/%s/pull-requests/%s' % (repo, review_id)
 
+    # Number of pull requests queried at once.
+    BITBUCKET_BATCH = 50
+
     def review_status(self, review_id):
         repo = "%s/%s" % (self.settings.BITBUCKET_PROJECT, self.settings.BITBUCKET_REPO)
         url = 'https://bitbucket.org/api/2.0/repositories/%s/pullrequests/%s' % (repo, review_id)
         resp = Requests(self.settings)(url, auth=self._review_auth())
         if not resp:
             return None
-        data = resp.json()
+        return self._review_state(resp.json())
+
+    def review_status_many(self, review_ids):
+        """
+        Fetch the statuses of the pull requests by filtered listing of the repository.
+        """
+        repo = "%s/%s" % (self.settings.BITBUCKET_PROJECT, self.settings.BITBUCKET_REPO)
+        ids = [int(id) for id in review_ids]
+        found = {}
+        for i in range(0, len(ids), self.BITBUCKET_BATCH):
+            batch = ids[i:i + self.BITBUCKET_BATCH]
+            url = 'https://bitbucket.org/api/2.0/repositories/%s/pullrequests' % repo
+            params = [('q', ' OR '.join('id = %d' % id for id in batch)),
+                      ('fields', '+values.participants'),
+                      ('pagelen', self.BITBUCKET_BATCH)]
+            # Listing has only open pull requests unless the states are given.
+            params += [('state', state) for state in ('OPEN', 'MERGED', 'DECLINED', 'SUPERSEDED')]
+            while url:
+                resp = Requests(self.settings)(url, get=params, auth=self._review_auth())
+                if resp is None:
+                    return [None] * len(ids)
+                if resp.status_code != 200:
+                    raise QError('Listing pull requests failed: %s', resp.text)
+                data = resp.json()
+                for pr in data.get('values', []):
+                    try:
+                        found[pr['id']] = self._review_state(pr)
+                    except QError as e:
+                        found[pr['id']] = e
+                # Next page link carries the query already.
+                url = data.get('next')
+                params = None
+        return [found.get(id) for id in ids]
+
+    def _review_state(self, data):
+        """
+        Resolve the review status from the pull request data.
+        """
         state = data['state']
         if state == 'OPEN':
             ok = 0
@@ -0,0 +1,199 @@
+import os
+import re
+import math
+import sqlite3
+
+
+class QSearch:
+    """
+    Persistent inverted index of the text files of the tickets stored in the WORKDIR.
+
+    The index is an SQLite database, so that a query reads only the postings of its own terms.
+    Files are re-indexed when their modification time or size changes. Database dumps,
+    compressed and binary files are not indexed.
+    """
+
+    # Schema version kept as the user_version of the database.
+    VERSION = 1
+    # File name endings never indexed.
+    SKIP = ('~', '.sql', '.gz', '.zip', '.tar', '.tgz', '.bz2', '.png', '.jpg', '.gif', '.pdf')
+    # Pattern for splitting text to terms.
+    TERM = re.compile(r'\w+', re.U)
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.db = None
+
+    def path(self):
+        return os.path.join(self.settings.WORKDIR, '.q.search')
+
+    def open(self):
+        """
+        Open the index database and create the tables, if it is new or not valid.
+        """
+        try:
+            self.db = sqlite3.connect(self.path())
+            version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.DatabaseError:
+            if self.db:
+                self.db.close()
+            os.unlink(self.path())
+            self.db = sqlite3.connect(self.path())
+            version = 0
+        if version != QSearch.VERSION:
+            self.db.executescript('''
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS postings;
+                CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, length INTEGER);
+                CREATE TABLE postings (term TEXT, file INTEGER, count INTEGER);
+                CREATE INDEX postings_term ON postings (term);
+                CREATE INDEX postings_file ON postings (file);
+                PRAGMA user_version = %d;
+            ''' % QSearch.VERSION)
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    @staticmethod
+    def tokenize(text):
+        """
+        Split the text to lower case terms.
+        """
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        return QSearch.TERM.findall(text.lower())
+
+    def indexable(self, path):
+        """
+        Check if the file name is not excluded from the index.
+        """
+        name = os.path.basename(path)
+        return not name.startswith('.') and not name.lower().endswith(QSearch.SKIP)
+
+    def read(self, path):
+        """
+        Read the text content of the file or None, if it is binary.
+        """
+        with open(path, 'rb') as input:
+            data = input.read()
+        if '\0' in data[0:8192]:
+            return None
+        return data.decode('utf-8', 'replace')
+
+    def remove(self, id):
+        """
+        Drop the file from the index.
+        """
+        self.db.execute('DELETE FROM postings WHERE file = ?', (id,))
+        self.db.execute('DELETE FROM files WHERE id = ?', (id,))
+
+    def add(self, rel, st, text):
+        """
+        Add the file content to the index.
+        """
+        counts = {}
+        terms = QSearch.tokenize(text) if text is not None else []
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        cursor = self.db.execute('INSERT INTO files (path, mtime, size, length) VALUES (?, ?, ?, ?)',
+                                 (rel, st.st_mtime, st.st_size, len(terms)))
+        id = cursor.lastrowid
+        self.db.executemany('INSERT INTO postings (term, file, count) VALUES (?, ?, ?)',
+                            [(term, id, counts[term]) for term in counts])
+
+    def refresh(self, codes):
+        """
+        Bring the index up to date for the files of the given tickets by re-reading only changed files.
+        """
+        if self.db is None:
+            self.open()
+        indexed = {}
+        for id, rel, mtime, size in self.db.execute('SELECT id, path, mtime, size FROM files'):
+            indexed[rel] = (id, mtime, size)
+        seen = set()
+        for code in codes:
+            for dir, dirs, names in os.walk(os.path.join(self.settings.WORKDIR, code)):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in names:
+                    path = os.path.join(dir, name)
+                    if not self.indexable(path):
+                        continue
+                    rel = os.path.relpath(path, self.settings.WORKDIR).decode('utf-8', 'replace')
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(rel)
+                    entry = indexed.get(rel)
+                    if entry is not None and entry[1] == st.st_mtime and entry[2] == st.st_size:
+                        continue
+                    if entry is not None:
+                        self.remove(entry[0])
+                    try:
+                        text = self.read(path)
+                    except IOError:
+                        continue
+                    self.add(rel, st, text)
+        for rel in indexed:
+            if rel not in seen:
+                self.remove(indexed[rel][0])
+        self.db.commit()
+
+    def search(self, codes, query):
+        """
+        Find files containing terms starting with all words of the query.
+
+        Returns a list of (score, path) tuples with the best matches first, where the
+        path is relative to the WORKDIR. Scoring is by tf-idf of the matching terms.
+        """
+        self.refresh(codes)
+        words = QSearch.tokenize(query)
+        total = self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        if not words or not total:
+            return []
+        scores = None
+        for word in words:
+            # All terms having the word as a prefix.
+            rows = self.db.execute('''
+                SELECT p.term, f.path, p.count, f.length FROM postings p JOIN files f ON f.id = p.file
+                WHERE p.term >= ? AND p.term < ?
+            ''', (word, word + u'\U0010ffff')).fetchall()
+            docs = {}
+            for term, rel, count, length in rows:
+                docs[term] = docs.get(term, 0) + 1
+            found = {}
+            for term, rel, count, length in rows:
+                idf = math.log(1.0 + float(total) / docs[term])
+                found[rel] = found.get(rel, 0) + idf * count / max(length, 1)
+            if scores is None:
+                scores = found
+            else:
+                scores = dict((rel, scores[rel] + found[rel]) for rel in scores if rel in found)
+            if not scores:
+                return []
+        return sorted([(scores[rel], rel) for rel in scores], reverse=True)
+
+    def context(self, rel, query, lines=2):
+        """
+        Collect the lines of the file matching any word of the query with surrounding lines.
+        """
+        words = QSearch.tokenize(query)
+        text = self.read(os.path.join(self.settings.WORKDIR, rel)) or u''
+        rows = text.split('\n')
+        show = set()
+        for i in range(len(rows)):
+            low = rows[i].lower()
+            for word in words:
+                if word in low:
+                    show.update(range(max(i - lines, 0), min(i + lines + 1, len(rows))))
+                    break
+        ret = []
+        prev = None
+        for i in sorted(show):
+            if prev is not None and i != prev + 1:
+                ret.append(u'--')
+            ret.append(rows[i])
+            prev = i
+        return u'\n'.join(ret)
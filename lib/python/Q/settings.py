@@ -1,12 +1,5 @@
-import sys
-import inspect
 import re
 import os
-import random
-import readline
-import glob
-import time
-import shutil
 
 from .file import QFile
 
@@ -24,6 +17,7 @@ class QSettings:
         self.APP_BUILDING = 'NoBuild'
         self.APP_TESTING = 'TestingByShellCommands'
         self.APP_TIMING = 'NoTiming'
+        self.APP_DATABASE = None
         # Root directory of the application git tree.
         self.APPDIR = None
         # Path to the settings (filled automatically).
@@ -38,6 +32,12 @@ class QSettings:
         self.ATLASSIAN_STATUS_DONE = 'Done'
         # Name of the status for available tickes.
         self.ATLASSIAN_STATUS_AVAILABLE = 'Backlog'
+        # JQL query selecting the tickets to store locally by `q prefetch`.
+        self.ATLASSIAN_PREFETCH_JQL = 'assignee = currentUser() AND statusCategory != Done ORDER BY updated DESC'
+        # How long in minutes workflow transition ids are cached.
+        self.ATLASSIAN_TRANSITION_TIME_MIN = 1440
+        # How many worklog writes per second at most are sent to the Atlassian server.
+        self.ATLASSIAN_RATE_LIMIT = 5
         # Password for the Bamboo.
         self.BAMBOO_PASSWORD = None
         # One or more Bamboo plan codes to launch build.
@@ -62,18 +62,32 @@ class QSettings:
         self.BRANCH_NAMING = '%c_%u_%t'
         # Command for local command line building.
         self.BUILD_COMMAND = None
+        # How long failed network queries are cached until retried.
+        self.CACHING_FAILURE_TIME_MIN = 1
+        # Maximum number of entries kept in the cache.
+        self.CACHING_MAX_ENTRIES = 1000
         # How long ticket build and review statuses are cached until refetched.
         self.CACHING_TIME_MIN = 5
+        # Caching times overriding CACHING_TIME_MIN as lines of <namespace>=<minutes>, e.g. Build=2.
+        self.CACHING_TIMES = None
         # Format of the commit message: %c ticket code, %m message
         self.COMMIT_MESSAGE = 'Ticket #%c: %m'
         # Name of the database.
         self.DB_NAME = None
+        # Name of the database keeping the pristine copy of a dump: %a application name, %s the content hash of the dump.
+        self.DB_SNAPSHOT_NAME = 'q_snapshot_%a_%s'
         # Which editor to use for editing text files.
         self.EDITOR = 'code'
         # User account in git.
         self.GIT_USER = None
         # Name of the remote used for storing feature branches.
         self.GIT_REMOTE = 'origin'
+        # Base delay in seconds for the exponential backoff between retried HTTP-requests.
+        self.HTTP_BACKOFF = 0.5
+        # How many times failed idempotent HTTP-requests are retried.
+        self.HTTP_RETRIES = 3
+        # Timeout in seconds for connecting and reading HTTP-responses.
+        self.HTTP_TIMEOUT = 30
         # Relative directory inside the project where Grunt jobs are run.
         self.GRUNT_DIR = None
         # URL for grunt builder: %c is build id.
@@ -88,6 +102,8 @@ class QSettings:
         self.LOBBY_BRANCH = 'master'
         # If set, do not do any network queries.
         self.OFFLINE_MODE = False
+        # How many threads to use at most for concurrent network queries.
+        self.PARALLEL_THREADS = 8
         # Name of the branch we merge tickets with merge releasing.
         self.RELEASE_BRANCH = None
         # URL of the server to be used for reviewing.
@@ -167,21 +183,34 @@ class QSettings:
         """
         QFile(path).save(self.dict())
 
+    # Parsed settings files by path as a tuple of modification time and data.
+    loaded = {}
+    # Settings files found by directory.
+    found = {}
+
     @staticmethod
     def load(path):
         """
-        Load the settings from the given file.
+        Load the settings from the given file. Files are parsed only once unless modified.
         """
-        data = QFile(path).load()
+        try:
+            mtime = os.path.getmtime(path)
+        except (OSError, TypeError):
+            mtime = None
+        cached = QSettings.loaded.get(path)
+        if cached is None or mtime is None or cached[0] != mtime:
+            data = QFile(path).load()
+            for k in data:
+                if data[k] == 'True':
+                    data[k] = True
+                if data[k] == 'None':
+                    data[k] = None
+                if data[k] == 'False':
+                    data[k] = False
+            cached = (mtime, data)
+            QSettings.loaded[path] = cached
         ret = QSettings()
-        for k in data:
-            if data[k] == 'True':
-                data[k] = True
-            if data[k] == 'None':
-                data[k] = None
-            if data[k] == 'False':
-                data[k] = False
-            ret.__dict__[k] = data[k]
+        ret.__dict__.update(cached[1])
         ret.APPSETTINGS = path
         return ret
 
@@ -190,13 +219,17 @@ class QSettings:
         """
         Find the nearest '.q' file from the directory or from its nearest possible parents.
         """
-        file = path + '/.q'
-        if os.path.isfile(file):
-            return file
-        parts = os.path.split(path)
-        if parts[0]=='/' or parts[0]=='':
-            return None
-        return QSettings.find(parts[0])
+        if path not in QSettings.found:
+            file = path + '/.q'
+            if os.path.isfile(file):
+                QSettings.found[path] = file
+            else:
+                parts = os.path.split(path)
+                if parts[0]=='/' or parts[0]=='':
+                    QSettings.found[path] = None
+                else:
+                    QSettings.found[path] = QSettings.find(parts[0])
+        return QSettings.found[path]
 
     @classmethod
     def find_by_code(cls, code):
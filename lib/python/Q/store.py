@@ -0,0 +1,82 @@
+import os
+import cPickle as pickle
+
+
+class QStore:
+    """
+    File of pickled data derived from the tickets, which can always be rebuilt from them.
+
+    Stores are only an optimization, so a file that cannot be read or has another format
+    version reads as empty and a failure to write it, e.g. into a read-only WORKDIR, is
+    ignored. The file starts with the version followed by one or more pickled objects,
+    so that records can be appended without rewriting the file.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        # Set if the last read stopped at a broken object.
+        self.broken = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        """
+        Read all objects of the file. Returns None if there is no valid file.
+        If a broken object is found, the objects before it are returned.
+        """
+        self.broken = False
+        ret = []
+        try:
+            with open(self.path, 'rb') as input:
+                if pickle.load(input) != self.version:
+                    return None
+                while True:
+                    try:
+                        ret.append(pickle.load(input))
+                    except EOFError:
+                        return ret
+        except IOError:
+            return None
+        except (EOFError, ValueError, TypeError, KeyError, IndexError, AttributeError, ImportError, pickle.UnpicklingError):
+            self.broken = True
+            return ret
+
+    def load(self):
+        """
+        Read the first object of the file or None.
+        """
+        objects = self.read()
+        if not objects or self.broken:
+            return None
+        return objects[0]
+
+    def write(self, *objects):
+        """
+        Replace the file atomically with the objects. Returns True on success.
+        """
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as output:
+                pickle.dump(self.version, output, pickle.HIGHEST_PROTOCOL)
+                for obj in objects:
+                    pickle.dump(obj, output, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def append(self, *objects):
+        """
+        Add the objects to the end of an existing file. Returns True on success.
+        """
+        if not self.exists():
+            return False
+        try:
+            with open(self.path, 'ab') as output:
+                for obj in objects:
+                    pickle.dump(obj, output, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            return False
+        return True
@@ -1,19 +1,16 @@
-import sys
-import inspect
 import re
 import os
-import random
-import readline
 import glob
 import time
 import shutil
 from time import localtime, strftime
-from distutils.dir_util import mkpath
 
 from .error import QError
 from .settings import QSettings
 from .file import QFile
 from .cache import QCache
+from .index import QIndex
+from .worklog import QWorkLog
 
 
 class Ticket:
@@ -80,6 +77,11 @@ class Ticket:
         self.root_path = self.settings.WORKDIR
         self.code = code
         self.data = {}
+        # Raw README content and offsets of the sections not decoded yet.
+        self.raw = None
+        self.offsets = {}
+        # If set, only indexed header fields are loaded so far.
+        self.partial = False
 
     def __setitem__(self, k, v):
         if type(v)==list:
@@ -95,6 +97,12 @@ class Ticket:
     def __getitem__(self, k):
         if k in self.data:
             return self.data[k]
+        if self.partial and k not in QIndex.KEYS:
+            self.read_sections()
+        if k in self.offsets:
+            start, end = self.offsets.pop(k)
+            self.data[k] = QFile.decode(self.raw[start:end])
+            return self.data[k]
         return None
 
     def __repr__(self):
@@ -158,9 +166,12 @@ class Ticket:
         """
         Delete ticket attribute.
         """
-        if k in self.data:
+        if self.partial:
+            self.read_sections()
+        if k in self.data or k in self.offsets:
             self.wr("Delete '%s'", k)
-            del self.data[k]
+            self.data.pop(k, None)
+            self.offsets.pop(k, None)
 
     def wr(self, *msg, **kwargs):
         """
@@ -227,24 +238,57 @@ class Ticket:
 
     def load(self):
         """
-        Load the ticket data.
+        Load the ticket data. Sections are located but decoded only once accessed.
         """
         self.data = {}
+        self.raw = None
+        self.offsets = {}
+        self.partial = False
         if not self.exists(self.code):
             self.create()
         else:
-            path = self.path('README')
-            self.data = QFile(path).load()
+            self.read_sections()
+
+    def load_fields(self, fields):
+        """
+        Set the indexed header fields and defer loading of the rest until needed.
+        """
+        self.data = dict(fields)
+        self.partial = True
+
+    def read_sections(self):
+        """
+        Read the README and locate its sections keeping values already set.
+        """
+        path = self.path('README')
+        if os.path.isfile(path):
+            self.raw, offsets = QFile(path).sections()
+            for k in offsets:
+                if k not in self.data:
+                    self.offsets[k] = offsets[k]
+        self.partial = False
+
+    def complete(self):
+        """
+        Decode all remaining sections of the ticket data.
+        """
+        if self.partial:
+            self.read_sections()
+        for k in list(self.offsets.keys()):
+            self.__getitem__(k)
+        self.raw = None
 
     def save(self):
         """
         Save the ticket data.
         """
+        self.complete()
         if not self.exists(self.code):
             self.create()
         path = self.path('README')
         self.wr("Saving ticket in '%s'.", path)
         QFile(path).save(self.data, self.all_keys())
+        QWorkLog.instance(self.settings).record(self)
         self.save_settings()
 
     def all_keys(self):
@@ -260,9 +304,11 @@ class Ticket:
         """
         Get the list of official keys found in ticket data.
         """
+        if self.partial:
+            self.read_sections()
         ret = []
         for k in self.all_keys():
-            if k in self.data:
+            if k in self.data or k in self.offsets:
                 ret.append(k)
         return ret
 
@@ -405,7 +451,7 @@ class Ticket:
     def stash_names(self):
         ret = {}
         from helper import Git
-        for line in Git(self.settings)('stash list', get_output=True, no_echo=True).strip().split("\n"):
+        for line in Git(self.settings).stash_list().strip().split("\n"):
             hit = re.match(r'(stash@\{.+\}).*QuickAutoStash_(.+)',line.strip())
             if hit:
                 ret[hit.group(2)] = hit.group(1)
@@ -489,22 +535,81 @@ class Ticket:
         """
         Refresh relevant fields carrying information about external processes etc.
         """
-        if self.finished():
-            return
+        Ticket.refresh_all([self])
+
+    def status_checks(self):
+        """
+        Collect tuples of cache namespace, key, query argument and status query function for the
+        pending build and review. The function resolves a list of arguments of the same namespace
+        at once returning a list of statuses.
+        """
+        ret = []
+        if self['Build ID'] and self['Build Result'] not in ['Success', 'Fail']:
+            ret.append(('Build', str(self['Build ID']), self, self.app.build_status_many))
+        if self['Review ID'] and self['Review Result'] not in ['Success', 'Fail']:
+            ret.append(('Review', str(self['Review ID']), self['Review ID'], self.app.review_status_many))
+        return ret
 
+    @staticmethod
+    def refresh_all(tickets):
+        """
+        Refresh several tickets at once.
+
+        The pending status queries of each project and namespace are resolved by one batch call
+        and the batches run concurrently.
+        """
+        from helper import Parallel
+        tickets = [t for t in tickets if not t.finished()]
+        states = {}
+        batches = []
+        pending = {}
+        for ticket in tickets:
+            path = ticket.settings.APPDIR
+            if path not in states:
+                states[path] = {}
+            if ticket.settings.OFFLINE_MODE:
+                continue
+            cache = QCache.instance(ticket.settings)
+            for namespace, key, arg, check in ticket.status_checks():
+                if (namespace, key) in states[path]:
+                    continue
+                entry = cache.lookup(namespace, key)
+                if entry is None:
+                    states[path][(namespace, key)] = None
+                    if (path, namespace) not in pending:
+                        pending[(path, namespace)] = (cache, namespace, {}, check)
+                        batches.append(pending[(path, namespace)])
+                    pending[(path, namespace)][2][key] = arg
+                else:
+                    states[path][(namespace, key)] = entry.get('value')
+
+        def resolve(batch):
+            cache, namespace, args, check = batch
+            return cache.get_many(namespace, list(args), lambda keys: check([args[key] for key in keys]))
+
+        if batches:
+            results = Parallel(tickets[0].settings)(resolve, batches)
+            for (cache, namespace, args, check), found in zip(batches, results):
+                for key in args:
+                    states[cache.settings.APPDIR][(namespace, key)] = found.get(key)
+
+        for ticket in tickets:
+            ticket.apply_refresh(states[ticket.settings.APPDIR])
+
+    def apply_refresh(self, states):
+        """
+        Update the results from the status queries and move the status forward accordingly.
+        """
         save = False
-        cache = QCache(self.settings)
 
         if self['Build ID'] and self['Build Result'] not in ['Success', 'Fail']:
-            check = lambda : self.app.build_status(self)
-            state = cache.get('Build ' + str(self['Build ID']), check)
+            state = states.get(('Build', str(self['Build ID'])))
             if state and self['Build Result'] != state:
                 self['Build Result'] = state
                 save = True
 
         if self['Review ID'] and self['Review Result'] not in ['Success', 'Fail']:
-            check = lambda : self.app.review_status(self['Review ID'])
-            state = cache.get('Review ' + str(self['Review ID']), check)
+            state = states.get(('Review', str(self['Review ID'])))
             if state and self['Review Result'] != state:
                 self['Review Result'] = state
                 save = True
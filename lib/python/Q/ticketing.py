@@ -1,9 +1,11 @@
-import xmlrpclib
-import json
-import urllib
+import os
 import re
+import json
+import time
 
 from .error import QError
+from .cache import QCache
+from .store import QStore
 from .ticket import Ticket
 from .helper import Curl, Requests
 from .conversions import html2markdown
@@ -58,6 +60,55 @@ class TicketingMixin:
         """
         raise QError("Not implemented in %s: fetch_ticket().", self.__class__.__name__)
 
+    def fetch_tickets(self, cmd, codes):
+        """
+        Get the data of several tickets as a list of Ticket instances in the same order.
+        None is given for a ticket not found.
+        """
+        return [self.fetch_ticket(cmd, code) for code in codes]
+
+    def prefetch_tickets(self, cmd):
+        """
+        Get the data of the tickets assigned to me as a list of Ticket instances.
+        """
+        raise QError("Not implemented in %s: prefetch_tickets().", self.__class__.__name__)
+
+    def _prefetch_store(self):
+        return QStore(os.path.join(self.settings.APPDIR, '.q.prefetch'), 1)
+
+    def _prefetch_load(self):
+        """
+        Read the stored ticket contents as a map from ticket codes to their fields.
+        """
+        data = self._prefetch_store().load()
+        if data is None:
+            return {}
+        return data['content']
+
+    def prefetched_ticket(self, code):
+        """
+        Construct the ticket from the content stored by the last prefetch or return None.
+        """
+        data = self._prefetch_load().get(code)
+        if data is None:
+            return None
+        ret = Ticket(self, code)
+        for k in data:
+            ret[k] = data[k]
+        return ret
+
+    def save_prefetched(self, tickets, replace=True):
+        """
+        Store the contents of the tickets for starting them later without queries.
+        Unless replacing, tickets stored earlier are kept.
+        """
+        content = {} if replace else self._prefetch_load()
+        for ticket in tickets:
+            content[ticket.code] = dict((k, ticket[k]) for k in ticket.keys())
+        store = self._prefetch_store()
+        if not store.write({'time': time.time(), 'content': content}):
+            raise QError("Cannot write prefetched tickets to %s.", store.path)
+
     def start_work_on_ticket(self, ticket):
         """
         Claim the ownership of the ticket and mark it that work has been started.
@@ -101,6 +152,7 @@ class TicketingByTrac(TicketingMixin):
     """
 
     def proxy(self):
+        import xmlrpclib
         user, password = self._get_user_and_password()
         url = self.settings.TICKETING_TRAC_API
         if not url:
@@ -113,6 +165,7 @@ class TicketingByTrac(TicketingMixin):
         """
         Fetch the ticket data for code.
         """
+        import xmlrpclib
         proxy = self.proxy()
         try:
             ret = proxy.ticket.get(code)
@@ -133,6 +186,7 @@ class TicketingByTrac(TicketingMixin):
             else:
                 v = "\\n ".join(parts)
             Q.wr('Ticketing', "  %s = %s" % (k, v))
+        import xmlrpclib
         proxy = self.proxy()
         try:
             proxy.ticket.update(code, comment, attributes)
@@ -203,6 +257,7 @@ class ManualTicketing(TicketingMixin):
     def fetch_ticket(self, cmd, code):
         cmd.wr("Creating a copy of the ticket manually.")
         cmd.wr("Please copy paste the title of the ticket:")
+        import readline
         title = raw_input()
         ret = Ticket(self, code)
         ret['Title'] = title.strip()
@@ -272,6 +327,7 @@ class TicketingByVSTS(TicketingMixin):
                 url += '&'
             else:
                 url += '?'
+            import urllib
             url += urllib.urlencode(params)
 
         data = Curl(self.settings)(url, user=user, password=password, post=post, patch=patch, content_type=content_type)
@@ -358,15 +414,62 @@ class TicketingByVSTS(TicketingMixin):
 
 class TicketingByAtlassian(TicketingMixin):
 
+    # Issue fields needed for constructing a ticket.
+    ATLASSIAN_FIELDS = ['summary', 'description', 'creator']
+    # Number of issues asked per page of search results.
+    ATLASSIAN_PAGE = 100
+
     def fetch_ticket(self, cmd, code):
         data = self._get_ticket(code)
+        return self._fields2ticket(code, data['fields'])
+
+    def fetch_tickets(self, cmd, codes):
+        if not codes:
+            return []
+        found = self._search_tickets('key in (%s)' % ', '.join(json.dumps(code) for code in codes))
+        return [self._fields2ticket(code, found[code]) if code in found else None for code in codes]
+
+    def prefetch_tickets(self, cmd):
+        found = self._search_tickets(self.settings.ATLASSIAN_PREFETCH_JQL)
+        return [self._fields2ticket(code, found[code]) for code in sorted(found.keys())]
+
+    def _fields2ticket(self, code, fields):
+        """
+        Construct a ticket from the issue fields.
+        """
         ret = Ticket(self, code)
-        if 'emailAddress' in data['fields']['creator']:
-            ret['Owner'] = data['fields']['creator']['emailAddress']
-        ret['Title'] = data['fields']['summary']
-        ret['Notes'] = data['fields']['description']
+        if fields['creator'] and 'emailAddress' in fields['creator']:
+            ret['Owner'] = fields['creator']['emailAddress']
+        ret['Title'] = fields['summary']
+        ret['Notes'] = fields['description']
         return ret
 
+    def _search_tickets(self, jql):
+        """
+        Run the JQL query and collect the needed fields of the issues found by their keys.
+        All pages of the results are read and warnings of the query, like unknown keys, are shown.
+        """
+        from q import Q
+        self._ticketing_check()
+        ret = {}
+        while True:
+            # Unknown keys produce a warning instead of failing the whole query.
+            query = {'jql': jql, 'fields': self.ATLASSIAN_FIELDS, 'startAt': len(ret),
+                     'maxResults': self.ATLASSIAN_PAGE, 'validateQuery': 'warn'}
+            resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/2/search', post=query, auth=self._ticketing_auth())
+            if resp is None:
+                return ret
+            if resp.status_code != 200:
+                raise QError("Searching tickets failed: %s", resp.text)
+            data = resp.json()
+            if not ret:
+                for warning in data.get('warningMessages', []):
+                    Q.wr('Ticketing', warning)
+            for issue in data['issues']:
+                ret[issue['key']] = issue['fields']
+            if not data['issues'] or len(ret) >= data['total']:
+                return ret
+
     def ticket_url(self, ticket):
         self._ticketing_check()
         return self.settings.ATLASSIAN_URL + 'browse/' + ticket.code
@@ -377,6 +480,9 @@ class TicketingByAtlassian(TicketingMixin):
         """
         if not self.settings.TICKETING_ID:
             raise QError("User for Atlassian TICKETING_ID is not set.")
+        if self.settings.OFFLINE_MODE:
+            self.cmd.wr("Offline mode, skipping claiming of the ticket.")
+            return
         data = {"accountId": self.settings.TICKETING_ID}
         resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/2/issue/' + ticket.code + '/assignee', put=data, auth=self._ticketing_auth())
         if (resp.status_code != 204):
@@ -396,13 +502,39 @@ class TicketingByAtlassian(TicketingMixin):
     def reopen_work_on_ticket(self, ticket):
         self._set_ticket_status(ticket, self.settings.ATLASSIAN_STATUS_WORKING)
 
-    def _ticketing_transition(self, ticket, name):
-        resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/2/issue/' + ticket.code + '/transitions', auth=self._ticketing_auth())
+    def _ticketing_transition(self, ticket, name, cached=True):
+        """
+        Find the transition with the given name from the current status of the ticket.
+
+        Transitions are cached by the project, the status and the name of the transition. The
+        status is the one the ticket was moved to last time, if known, so that a cached transition
+        needs no queries. Otherwise all transitions from the current status are fetched and cached.
+
+        @return Cached entry with the transition 'id' and the target status as 'to'.
+        """
+        cache = QCache.instance(self.settings)
+        project = ticket.code.split('-')[0]
+        if cached:
+            status = cache.lookup('AtlassianStatus', ticket.code)
+            if status and 'value' in status:
+                entry = cache.lookup('AtlassianTransition', (project, status['value'], name.upper()))
+                if entry and 'value' in entry:
+                    return dict(entry['value'], cached=True)
+        resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/2/issue/' + ticket.code,
+                                       get={'fields': 'status', 'expand': 'transitions'}, auth=self._ticketing_auth())
         data = resp.json()
+        status = data['fields']['status']['name']
+        ttl = self.settings.ATLASSIAN_TRANSITION_TIME_MIN
+        cache.put('AtlassianStatus', ticket.code, status, ttl)
+        ret = None
         for tr in data['transitions']:
+            value = {'id': tr['id'], 'to': tr['to']['name']}
+            cache.put('AtlassianTransition', (project, status, tr['name'].upper()), value, ttl)
             if tr['name'].upper() == name.upper():
-                return tr['id']
-        raise QError("Cannot find transition called %r." % name)
+                ret = dict(value)
+        if ret is None:
+            raise QError("Cannot find transition called %r." % name)
+        return ret
 
     def _ticketing_check(self):
         """
@@ -433,9 +565,17 @@ class TicketingByAtlassian(TicketingMixin):
         if status is None:
             self.cmd.wr("No status in ticketing system, skipping status change.")
             return
+        if self.settings.OFFLINE_MODE:
+            self.cmd.wr("Offline mode, skipping status change to %r.", status)
+            return
         self.cmd.wr("Setting ticket status of %r to %r.", ticket.code, status)
-        id = self._ticketing_transition(ticket, status)
-        data = {"transition": {"id": id}}
-        resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/2/issue/' + ticket.code + '/transitions', post=data, auth=self._ticketing_auth())
+        url = self.settings.ATLASSIAN_URL + '/rest/api/2/issue/' + ticket.code + '/transitions'
+        tr = self._ticketing_transition(ticket, status)
+        resp = Requests(self.settings)(url, post={"transition": {"id": tr['id']}}, auth=self._ticketing_auth())
+        if resp.status_code == 400 and tr.get('cached'):
+            # Status changed elsewhere or the workflow has been edited.
+            tr = self._ticketing_transition(ticket, status, cached=False)
+            resp = Requests(self.settings)(url, post={"transition": {"id": tr['id']}}, auth=self._ticketing_auth())
         if (resp.status_code != 204):
             raise QError("Setting ticket %r state failed." % status)
+        QCache.instance(self.settings).put('AtlassianStatus', ticket.code, tr['to'], self.settings.ATLASSIAN_TRANSITION_TIME_MIN)
@@ -1,20 +1,30 @@
 import re
 import os
-import pickle
+import time
+import array
+import calendar
 import datetime
 from time import localtime, strftime
 from .error import QError
+from .file import QFile
 from .ticket import Ticket
 from .helper import Curl, Requests
 
-class WorkEntry:
+class WorkEntry(object):
+    """
+    Storage for work log entry.
+
+    Time stamps are parsed once to integer seconds of the naive local time, while
+    `start` and `stop` are still available as strings of the ticket format.
+    """
+
+    __slots__ = ['code', 'text', 'begin', 'end', '_start', '_stop']
 
     PLACEHOLDER = '????-??-?? ??:??:??'
     JOIN_LIMIT_MIN = 15
+    # Seconds at the start of each date seen.
+    days = {}
 
-    """
-    Storage for work log entry.
-    """
     def __init__(self, code=None, start=None, stop=None, text=None):
         self.code = code
         self.start = start
@@ -24,6 +34,45 @@ class WorkEntry:
     def __repr__(self):
         return '<Q.WorkEntry %s - %s %s %s>' % (self.start, self.stop or WorkEntry.PLACEHOLDER, self.code, self.text)
 
+    @staticmethod
+    def stamp(s):
+        """
+        Convert time string to seconds or None, if not given.
+        """
+        if s is None:
+            return None
+        # Fixed positions are much faster than strptime() and dates repeat a lot.
+        day = WorkEntry.days.get(s[0:10])
+        if day is None:
+            day = calendar.timegm((int(s[0:4]), int(s[5:7]), int(s[8:10]), 0, 0, 0))
+            WorkEntry.days[s[0:10]] = day
+        return day + int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+
+    @staticmethod
+    def current():
+        """
+        Current naive local time in seconds.
+        """
+        return calendar.timegm(time.localtime())
+
+    def get_start(self):
+        return self._start
+
+    def set_start(self, s):
+        self.begin = WorkEntry.stamp(s)
+        self._start = s
+
+    start = property(get_start, set_start)
+
+    def get_stop(self):
+        return self._stop
+
+    def set_stop(self, s):
+        self.end = WorkEntry.stamp(s)
+        self._stop = s
+
+    stop = property(get_stop, set_stop)
+
     def human(self):
         """
         Human readable period length.
@@ -42,24 +91,20 @@ class WorkEntry:
         """
         How many seconds of work.
         """
-        t1 = datetime.datetime.strptime(self.start, '%Y-%m-%d %H:%M:%S')
-        if self.stop:
-            t2 = datetime.datetime.strptime(self.stop, '%Y-%m-%d %H:%M:%S')
-        else:
-            t2 = datetime.datetime.now()
-        return (t2 - t1).total_seconds()
+        if self.end is None:
+            return WorkEntry.current() - self.begin
+        return self.end - self.begin
 
     def minutes(self):
         """
         How many minutes of work.
         """
-        return self.seconds() / 60
+        return self.seconds() / 60.0
 
     def get_start_stamp(self):
         """
         Format starting time to ISO-format.
         """
-        import time
         tz = -(time.timezone / 3600.0)
         if time.localtime( ).tm_isdst > 0:
             tz += 1
@@ -140,13 +185,31 @@ class WorkEntry:
 
     @classmethod
     def from_str(cls, s):
-        ret = WorkEntry()
-        ret.start = s[0: 19]
-        ret.stop = s[22: 22 + 19]
-        if ret.stop == WorkEntry.PLACEHOLDER:
-            ret.stop = None
-        ret.text = s[22 + 19 + 1:]
-        return ret
+        stop = s[22: 22 + 19]
+        if stop == WorkEntry.PLACEHOLDER:
+            stop = None
+        return WorkEntry(start=s[0: 19], stop=stop, text=s[22 + 19 + 1:])
+
+
+def work_totals(entries):
+    """
+    Compute total minutes of work per date and per ticket code in one pass over the entries.
+    """
+    now = WorkEntry.current()
+    begins = array.array('l', [e.begin for e in entries])
+    ends = array.array('l', [now if e.end is None else e.end for e in entries])
+    days = {}
+    codes = {}
+    for i in xrange(len(begins)):
+        m = (ends[i] - begins[i]) / 60.0
+        day = begins[i] // 86400
+        days[day] = days.get(day, 0) + m
+        code = entries[i].code
+        codes[code] = codes.get(code, 0) + m
+    dates = {}
+    for day in days:
+        dates[time.strftime('%Y-%m-%d', time.gmtime(day * 86400))] = days[day]
+    return dates, codes
 
 
 class TimingMixin:
@@ -164,22 +227,17 @@ class TimingMixin:
         """
         Load all timing entries for the project.
         """
-        ret = []
-        for ticket in project.all_tickets():
-            times = ticket.work_timing()
-            if date is not None:
-                times = filter(lambda x: x.start[0:10] == date, times)
-            ret += times
-        ret.sort(key = lambda w: w.start)
-        return ret
+        from .worklog import QWorkLog
+        return QWorkLog.instance(project.settings).entries(project.all_codes(), date)
 
     def timing_get_full_list(self, date=None):
         """
         Get the full list of timing records.
         """
+        from .helper import Parallel
         ret = []
-        for project in self.cmd.app.q.projects:
-            ret += self.timing_load(project, date)
+        for times in Parallel(self.settings)(lambda project: self.timing_load(project, date), self.cmd.app.q.all_projects()):
+            ret += times
         ret.sort(key = lambda w: w.start)
         return ret
 
@@ -187,9 +245,12 @@ class TimingMixin:
         """
         Get the last recorded timing entry or empty record if none.
         """
-        work = self.timing_get_full_list()
-        if len(work):
-            return work[-1]
+        from .helper import Parallel
+        from .worklog import QWorkLog
+        latest = Parallel(self.settings)(lambda project: QWorkLog.instance(project.settings).latest(project.all_codes()), self.cmd.app.q.all_projects())
+        latest = [w for w in latest if w is not None]
+        if len(latest):
+            return max(latest, key = lambda w: w.start)
         return None
 
     def _parse_timing_date(self, time):
@@ -234,7 +295,13 @@ class TimingMixin:
         """
         Push the timing data to the remote.
         """
-        raise QError("Not implemented in %s: timing_push_ticket().", self.__class__.__name__)
+        self.timing_push_tickets([ticket])
+
+    def timing_push_tickets(self, tickets, dry=False):
+        """
+        Push the timing data of several tickets to the remote. In dry-run only report the changes.
+        """
+        raise QError("Not implemented in %s: timing_push_tickets().", self.__class__.__name__)
 
 
 class NoTiming(TimingMixin):
@@ -252,52 +319,156 @@ class TimingByAtlassian(TimingMixin):
             Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/3/issue/' + ticket.code + '/worklog/' + work['id'], delete=True, auth=self._ticketing_auth())
 
 
-    def timing_push_ticket(self, ticket):
-        # self.__remove_atlassian_worklog(ticket)
-        resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/3/issue/' + ticket.code + '/worklog', auth=self._ticketing_auth())
+    def _atlassian_worklog_url(self, code, id=None):
+        url = self.settings.ATLASSIAN_URL + '/rest/api/3/issue/' + code + '/worklog'
+        if id is not None:
+            url += '/' + id
+        return url
+
+    def _atlassian_worklogs(self, ticket):
+        """
+        Fetch the remote worklog entries of the ticket recorded by us.
+        """
+        resp = Requests(self.settings)(self._atlassian_worklog_url(ticket.code), auth=self._ticketing_auth())
+        ret = []
+        for work in resp.json()['worklogs']:
+            if 'emailAddress' in work['author'] and  work['author']['emailAddress'] == self.settings.TICKETING_USER:
+                ret.append(work)
+        return ret
+
+    def _atlassian_worklog_changes(self, ticket, worklogs):
+        """
+        Compare the local work entries to the remote ones.
+
+        Returns a list of deletions as tuples (code, id, time, minutes) and a list of additions
+        as tuples (code, data, time, minutes).
+        """
         # Find existing.
         existing = set()
         ids = {}
         spent = {}
-        for work in resp.json()['worklogs']:
-            if 'emailAddress' in work['author'] and  work['author']['emailAddress'] == self.settings.TICKETING_USER:
-                time = work['started'][0:16]
-                workSpent = int(work['timeSpentSeconds'])
-                name = time + '/' + str(workSpent)
-                ids[time] = work['id']
-                spent[time] = workSpent
-                existing.add(time)
-                existing.add(name)
-
-        # Remove overlapping starting time entries.
+        for work in worklogs:
+            time = work['started'][0:16]
+            workSpent = int(work['timeSpentSeconds'])
+            name = time + '/' + str(workSpent)
+            ids[time] = work['id']
+            spent[time] = workSpent
+            existing.add(time)
+            existing.add(name)
+
+        deletes = []
+        posts = []
+        deleted = set()
         for work in ticket.work_timing():
-            if work.stop:
-                time = work.get_start_stamp()[0:16]
-                name = time + '/' + str(int(work.seconds()))
-                if not name in existing and time in existing:
-                    ticket.wr('Deleting worklog of %s at %s for %d minutes' % (work.code, work.get_start_stamp()[0:16], spent[time] / 60))
-                    Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/3/issue/' + ticket.code + '/worklog/' + ids[time], delete=True, auth=self._ticketing_auth())
-
-        # Write new or changed entries.
-        for work in ticket.work_timing():
-            if work.stop:
-                time = work.get_start_stamp()[0:16]
-                name = time + '/' + str(int(work.seconds()))
-                if not name in existing:
-                    data = {"timeSpentSeconds": work.seconds(), "started": work.get_start_stamp()}
-                    ticket.wr('Recording worklog %s at %s for %d minutes' % (work.code, work.get_start_stamp()[0:16], work.minutes()))
-                    if work.text is not None:
-                        data["comment"] = {
-                            "type": "doc",
-                            "version": 1,
-                            "content": [{
-                                "type": "paragraph",
-                                "content": [
-                                    {
-                                        "text": work.text,
-                                        "type": "text"
-                                    }
-                                ]
-                            }]
-                        }
-                    resp = Requests(self.settings)(self.settings.ATLASSIAN_URL + '/rest/api/3/issue/' + work.code + '/worklog', post=data, auth=self._ticketing_auth())
+            if not work.stop:
+                continue
+            time = work.get_start_stamp()[0:16]
+            name = time + '/' + str(int(work.seconds()))
+            if name in existing:
+                continue
+            # Remove overlapping starting time entries.
+            if time in existing and time not in deleted:
+                deleted.add(time)
+                deletes.append((ticket.code, ids[time], time, spent[time] / 60))
+            # Write new or changed entries.
+            data = {"timeSpentSeconds": work.seconds(), "started": work.get_start_stamp()}
+            if work.text is not None:
+                data["comment"] = {
+                    "type": "doc",
+                    "version": 1,
+                    "content": [{
+                        "type": "paragraph",
+                        "content": [
+                            {
+                                "text": work.text,
+                                "type": "text"
+                            }
+                        ]
+                    }]
+                }
+            posts.append((work.code, data, time, work.minutes()))
+        return deletes, posts
+
+    def _atlassian_synced(self, ticket):
+        """
+        Load the worklog entries as recorded by the last push or None, if not pushed yet.
+
+        The sync file maps the starting time of each pushed entry to its duration and remote id.
+        Removing the file forces comparison against the remote on the next push.
+        """
+        path = ticket.path('worklog.sync')
+        if not os.path.exists(path):
+            return None
+        ret = []
+        data = QFile(path).load()
+        for time in data:
+            seconds, id = data[time].split(' ')
+            ret.append({'started': time, 'timeSpentSeconds': seconds, 'id': id})
+        return ret
+
+    def _atlassian_worklog_ok(self, code, time, resp):
+        """
+        Check the result of a worklog write and report it, if failed.
+        """
+        from q import Q
+        if isinstance(resp, BaseException):
+            Q.wr('Timing', Q.ERROR + 'Writing worklog of %s at %s failed: %s' + Q.END, code, time, resp)
+            return False
+        if resp is None:
+            return False
+        if not resp.ok:
+            Q.wr('Timing', Q.ERROR + 'Writing worklog of %s at %s failed: %s %s' + Q.END, code, time, resp.status_code, resp.text)
+            return False
+        return True
+
+    def timing_push_tickets(self, tickets, dry=False):
+        """
+        Write the differences of the work entries to the remote concurrently under the rate limit.
+
+        Tickets pushed before are compared to their sync file, while the others are compared
+        to the remote worklogs fetched concurrently.
+        """
+        from q import Q
+        from .helper import Parallel
+        synced = [self._atlassian_synced(ticket) for ticket in tickets]
+        fetch = [ticket for ticket, worklogs in zip(tickets, synced) if worklogs is None]
+        remote = dict(zip([ticket.code for ticket in fetch], Parallel(self.settings)(self._atlassian_worklogs, fetch)))
+        states = {}
+        deletes = []
+        posts = []
+        for ticket, worklogs in zip(tickets, synced):
+            if worklogs is None:
+                worklogs = remote[ticket.code]
+            states[ticket.code] = dict((w['started'][0:16], (int(w['timeSpentSeconds']), w['id'])) for w in worklogs)
+            d, p = self._atlassian_worklog_changes(ticket, worklogs)
+            deletes += d
+            posts += p
+        for code, id, time, minutes in deletes:
+            Q.wr('Timing', 'Deleting worklog of %s at %s for %d minutes', code, time, minutes)
+        for code, data, time, minutes in posts:
+            Q.wr('Timing', 'Recording worklog %s at %s for %d minutes', code, time, minutes)
+        if dry:
+            Q.wr('Timing', 'Dry-run: %d tickets checked, %d fetched, %d worklogs to delete and %d to record.', len(tickets), len(fetch), len(deletes), len(posts))
+            return
+        rate = float(self.settings.ATLASSIAN_RATE_LIMIT)
+        auth = self._ticketing_auth()
+        # A failed write is returned as its exception, so that the successful ones are saved.
+        deleted = Parallel(self.settings)(lambda d: Requests(self.settings)(self._atlassian_worklog_url(d[0], d[1]), delete=True, auth=auth), deletes, rate=rate, errors=True)
+        posted = Parallel(self.settings)(lambda p: Requests(self.settings)(self._atlassian_worklog_url(p[0]), post=p[1], auth=auth), posts, rate=rate, errors=True)
+        removed = 0
+        recorded = 0
+        for (code, id, time, minutes), resp in zip(deletes, deleted):
+            if self._atlassian_worklog_ok(code, time, resp):
+                del states[code][time]
+                removed += 1
+        for (code, data, time, minutes), resp in zip(posts, posted):
+            if self._atlassian_worklog_ok(code, time, resp):
+                states[code][time] = (int(data['timeSpentSeconds']), resp.json()['id'])
+                recorded += 1
+        changed = set([d[0] for d in deletes] + [p[0] for p in posts])
+        for ticket, worklogs in zip(tickets, synced):
+            if worklogs is None or ticket.code in changed:
+                state = states[ticket.code]
+                QFile(ticket.path('worklog.sync')).save(dict((time, '%d %s' % state[time]) for time in state))
+        Q.wr('Timing', '%d tickets checked, %d fetched, %d worklogs deleted and %d recorded, %d failed.', len(tickets), len(fetch), removed, recorded,
+             len(deletes) + len(posts) - removed - recorded)
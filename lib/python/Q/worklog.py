@@ -0,0 +1,231 @@
+import os
+import threading
+
+from .file import QFile
+from .store import QStore
+
+
+class QWorkLog:
+    """
+    Indexed journal of the work log entries of the tickets stored in the WORKDIR.
+
+    The journal starts with a snapshot holding the `Work` lines of each ticket together with
+    the stamp of its README, the lines by date and ticket, the latest line of each ticket and
+    the latest line of all. Changes of tickets are appended as records and applied to the
+    snapshot when loading. A ticket is valid as long as its README has not changed, which is
+    checked once per process. Later changes in the same process are recorded on saving.
+    """
+
+    # Version of the journal content, changed when its content changes.
+    VERSION = 2
+    # Number of records allowed after the snapshot before the journal is rewritten.
+    COMPACT_LIMIT = 100
+
+    # Shared instances by the path of the journal.
+    instances = {}
+    lock = threading.Lock()
+
+    def __init__(self, settings):
+        self.settings = settings
+        # Latest snapshot of each ticket as (stamp, lines).
+        self.tickets = None
+        # Work log lines by date and ticket code.
+        self.dates = None
+        # Line with the latest starting time by ticket code.
+        self.latest_lines = None
+        # The latest line of all as (code, line) or None.
+        self.last = None
+        # Number of records after the snapshot in the journal file.
+        self.records = 0
+        # Set if the journal file needs to be rewritten.
+        self.invalid = False
+        # Ticket codes checked against their READMEs in this process.
+        self.checked = None
+
+    @classmethod
+    def instance(cls, settings):
+        """
+        Get the shared journal of the WORKDIR.
+        """
+        path = os.path.join(settings.WORKDIR, '.q.worklog')
+        with cls.lock:
+            if path not in cls.instances:
+                cls.instances[path] = QWorkLog(settings)
+            return cls.instances[path]
+
+    def path(self):
+        return os.path.join(self.settings.WORKDIR, '.q.worklog')
+
+    def store(self):
+        return QStore(self.path(), QWorkLog.VERSION)
+
+    def load(self):
+        """
+        Read the snapshot and apply the records appended after it.
+        """
+        self.tickets = {}
+        self.dates = {}
+        self.latest_lines = {}
+        self.last = None
+        store = self.store()
+        objects = store.read()
+        # Keep what was read before a broken record and rewrite the journal.
+        self.invalid = not objects or store.broken or not isinstance(objects[0], dict)
+        if not objects or not isinstance(objects[0], dict):
+            self.records = 0
+            return
+        snapshot = objects[0]
+        self.tickets = snapshot['tickets']
+        self.dates = snapshot['dates']
+        self.latest_lines = snapshot['latest']
+        self.last = snapshot['last']
+        self.records = len(objects) - 1
+        for code, stamp, lines in objects[1:]:
+            self.update(code, stamp, lines)
+
+    def write(self, records):
+        """
+        Append records to the journal or rewrite it compactly, if it has grown too large.
+        """
+        if self.invalid or self.records + len(records) > QWorkLog.COMPACT_LIMIT:
+            snapshot = {'tickets': self.tickets, 'dates': self.dates, 'latest': self.latest_lines, 'last': self.last}
+            if self.store().write(snapshot):
+                self.records = 0
+                self.invalid = False
+        elif self.store().append(*records):
+            self.records += len(records)
+
+    def update(self, code, stamp, lines):
+        """
+        Replace the work log lines of the ticket in the indices or remove the ticket, if the stamp is None.
+        The cost depends only on the number of lines of the ticket, unless it had the latest line of all.
+        """
+        old = self.tickets.pop(code, None)
+        if old is not None:
+            for date in set(line[0:10] for line in old[1]):
+                found = self.dates.get(date)
+                if found is not None:
+                    found.pop(code, None)
+                    if not found:
+                        del self.dates[date]
+        self.latest_lines.pop(code, None)
+        if stamp is not None:
+            self.tickets[code] = (stamp, lines)
+            for line in lines:
+                self.dates.setdefault(line[0:10], {}).setdefault(code, []).append(line)
+                if code not in self.latest_lines or line[0:19] >= self.latest_lines[code][0:19]:
+                    self.latest_lines[code] = line
+        if self.last is not None and self.last[0] == code:
+            self.last = None
+            for other in self.latest_lines:
+                line = self.latest_lines[other]
+                if self.last is None or line[0:19] >= self.last[1][0:19]:
+                    self.last = (other, line)
+        elif code in self.latest_lines:
+            line = self.latest_lines[code]
+            if self.last is None or line[0:19] >= self.last[1][0:19]:
+                self.last = (code, line)
+
+    @staticmethod
+    def lines(work):
+        """
+        Split the value of the `Work` field to lines.
+        """
+        if work is None or work == '':
+            return []
+        return work.split('\n')
+
+    def stamp(self, code):
+        """
+        Get the stamp of the README of the ticket or None if it does not exist.
+        """
+        try:
+            st = os.stat(os.path.join(self.settings.WORKDIR, code, 'README'))
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def refresh(self, codes):
+        """
+        Bring the journal up to date for the given ticket codes by re-reading only changed READMEs.
+        """
+        if self.tickets is None:
+            self.load()
+        codes = list(codes)
+        if self.checked == set(codes):
+            return
+        records = []
+        seen = set()
+        for code in codes:
+            seen.add(code)
+            stamp = self.stamp(code)
+            if stamp is None:
+                continue
+            entry = self.tickets.get(code)
+            if entry is None or entry[0] != stamp:
+                raw, offsets = QFile(os.path.join(self.settings.WORKDIR, code, 'README')).sections()
+                work = None
+                if 'Work' in offsets:
+                    start, end = offsets['Work']
+                    work = QFile.decode(raw[start:end])
+                lines = QWorkLog.lines(work)
+                self.update(code, stamp, lines)
+                records.append((code, stamp, lines))
+        for code in list(self.tickets.keys()):
+            if code not in seen:
+                self.update(code, None, None)
+                records.append((code, None, None))
+        if records or self.invalid:
+            self.write(records)
+        self.checked = seen
+
+    def record(self, ticket):
+        """
+        Append the current work log of the saved ticket, if the journal is in use.
+        """
+        store = self.store()
+        if not store.exists():
+            return
+        stamp = self.stamp(ticket.code)
+        if stamp is None:
+            return
+        lines = QWorkLog.lines(ticket['Work'])
+        if self.tickets is not None:
+            self.update(ticket.code, stamp, lines)
+        if store.append((ticket.code, stamp, lines)):
+            self.records += 1
+
+    def entry(self, code, line):
+        """
+        Convert a work log line of the ticket to an entry.
+        """
+        from .timing import WorkEntry
+        ret = WorkEntry.from_str(line)
+        ret.code = code
+        return ret
+
+    def entries(self, codes, date=None):
+        """
+        Get the work entries of the given tickets sorted by the starting time, optionally only for one date.
+        """
+        self.refresh(codes)
+        found = []
+        if date is None:
+            for code in self.tickets:
+                found += [(code, line) for line in self.tickets[code][1]]
+        else:
+            lines = self.dates.get(date, {})
+            for code in lines:
+                found += [(code, line) for line in lines[code]]
+        ret = [self.entry(code, line) for code, line in found]
+        ret.sort(key = lambda w: w.start)
+        return ret
+
+    def latest(self, codes):
+        """
+        Get the work entry with the latest starting time or None if there are no entries.
+        """
+        self.refresh(codes)
+        if self.last is None:
+            return None
+        return self.entry(*self.last)